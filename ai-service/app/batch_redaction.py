@@ -0,0 +1,182 @@
+import asyncio
+import time
+from typing import List, Dict, Optional, AsyncIterator
+
+from app.ocr import OCRService
+from app.pii import PIIService
+from app.image_input import download_image
+from app.ingestion import ImageBudget
+
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class _StageFailed:
+    """Put on the output queue when a whole stage dies outside its per-step handling"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class RedactionPipeline:
+    """Guide-level redaction with overlapping download, OCR and PII stages.
+
+    Downloads run concurrently and feed a pool of OCR workers; a single PII
+    worker drains whatever OCR texts are ready and analyzes them as one
+    Presidio/spaCy batch. Per-step results are yielded as soon as they are
+    complete, so they arrive out of order.
+    """
+
+    def __init__(
+        self,
+        ocr_service: OCRService,
+        pii_service: PIIService,
+        download_concurrency: int = 8,
+        ocr_concurrency: int = 2,
+        pii_batch_size: int = 16,
+        image_budget: Optional[ImageBudget] = None,
+    ):
+        self.ocr_service = ocr_service
+        self.pii_service = pii_service
+        self.download_concurrency = download_concurrency
+        self.ocr_concurrency = ocr_concurrency
+        self.pii_batch_size = pii_batch_size
+        self.image_budget = image_budget
+
+    async def run(
+        self,
+        items: List[Dict],
+        pii_mode: str = "full",
+        pii_entities: Optional[List[str]] = None,
+    ) -> AsyncIterator[Dict]:
+        """Yield one result dict per {stepId, screenshotUri} item"""
+
+        ocr_queue: asyncio.Queue = asyncio.Queue(maxsize=self.ocr_concurrency * 2)
+        pii_queue: asyncio.Queue = asyncio.Queue()
+        out_queue: asyncio.Queue = asyncio.Queue()
+
+        async def download_stage():
+            semaphore = asyncio.Semaphore(self.download_concurrency)
+            max_bytes = self.image_budget.max_bytes if self.image_budget is not None else None
+
+            async def download(item: Dict):
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        image_bytes = await download_image(item["screenshotUri"], max_bytes)
+                    except Exception as e:
+                        await out_queue.put(self._error(item, e))
+                        return
+                    timings = {"download": self._elapsed_ms(started)}
+                    # Put while holding the slot so downloads can't run
+                    # far ahead of OCR and pile up image bytes
+                    await ocr_queue.put((item, image_bytes, timings))
+
+            await asyncio.gather(*(download(item) for item in items))
+
+            for _ in range(self.ocr_concurrency):
+                await ocr_queue.put(_DONE)
+
+        async def ocr_worker():
+            while True:
+                entry = await ocr_queue.get()
+                if entry is _DONE:
+                    await pii_queue.put(_DONE)
+                    return
+                item, image_bytes, timings = entry
+                started = time.perf_counter()
+                try:
+                    if self.image_budget is None:
+                        ocr_result = await self.ocr_service.extract_text(image_bytes)
+                    else:
+                        async with self.image_budget.admit(image_bytes) as image_source:
+                            ocr_result = await self.ocr_service.extract_text(image_source)
+                except Exception as e:
+                    await out_queue.put(self._error(item, e))
+                    continue
+                timings["ocr"] = self._elapsed_ms(started)
+                await pii_queue.put((item, ocr_result, timings))
+
+        async def pii_stage():
+            finished_workers = 0
+            while finished_workers < self.ocr_concurrency:
+                batch = []
+                entry = await pii_queue.get()
+                while True:
+                    if entry is _DONE:
+                        finished_workers += 1
+                    else:
+                        batch.append(entry)
+                    if len(batch) >= self.pii_batch_size or pii_queue.empty():
+                        break
+                    entry = pii_queue.get_nowait()
+
+                if not batch:
+                    continue
+
+                started = time.perf_counter()
+                texts = [ocr_result.text for _, ocr_result, _ in batch]
+                try:
+                    pii_results = await asyncio.to_thread(
+                        self.pii_service.detect_pii_batch, texts, pii_mode, pii_entities
+                    )
+                except Exception as e:
+                    for item, _, _ in batch:
+                        await out_queue.put(self._error(item, e))
+                    continue
+                pii_ms = self._elapsed_ms(started)
+
+                for (item, ocr_result, timings), pii_result in zip(batch, pii_results):
+                    timings["pii"] = pii_ms
+                    timings["piiBatchSize"] = len(batch)
+                    await out_queue.put({
+                        "stepId": item["stepId"],
+                        "ocr": {
+                            "text": ocr_result.text,
+                            "confidence": ocr_result.confidence,
+                            "regions": ocr_result.regions,
+                        },
+                        "pii": {
+                            "entities": pii_result.entities,
+                            "blurredRegions": pii_result.blurred_regions,
+                        },
+                        "timings": timings,
+                    })
+
+        async def supervised(stage):
+            try:
+                await stage
+            except Exception as e:
+                print(f"[BatchRedaction] Stage failed: {e}")
+                await out_queue.put(_StageFailed(e))
+
+        stages = [download_stage(), pii_stage()]
+        stages.extend(ocr_worker() for _ in range(self.ocr_concurrency))
+        tasks = [asyncio.create_task(supervised(stage)) for stage in stages]
+
+        try:
+            pending = [item.get("stepId") for item in items]
+            while pending:
+                result = await out_queue.get()
+                if isinstance(result, _StageFailed):
+                    # Steps still in flight will never come out; fail them
+                    for step_id in pending:
+                        yield self._error({"stepId": step_id}, result.error)
+                    return
+                pending.remove(result["stepId"])
+                yield result
+        finally:
+            # Client went away or we're done: stop any remaining stage work
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _error(item: Dict, error: Exception) -> Dict:
+        print(f"[BatchRedaction] Step {item.get('stepId')} failed: {error}")
+        return {"stepId": item.get("stepId"), "error": str(error)}
+
+    @staticmethod
+    def _elapsed_ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
@@ -2,6 +2,9 @@ import os
 import google.generativeai as genai
 from typing import List, Dict
 
+from app.llm_hedging import LLMHedger
+from app.step_compaction import estimate_tokens
+
 
 class DocumentComposer:
     """AI document composer using Google Gemini"""
@@ -13,6 +16,13 @@ class DocumentComposer:
         genai.configure(api_key=api_key)
         # Use gemini-2.5-flash for faster responses (latest stable model)
         self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # Long generations: deadline-bound, but hedging is opt-in
+        self.hedger = LLMHedger(
+            "compose",
+            hedging=os.getenv("COMPOSE_HEDGING", "false").lower() == "true",
+            hedge_default_ms=float(os.getenv("COMPOSE_HEDGE_DEFAULT_MS", "30000")),
+            max_hedge_ratio=float(os.getenv("LLM_HEDGE_BUDGET", "0.1")),
+        )
 
     async def compose(self, steps: List[Dict], style: str = "professional") -> str:
         """Compose document from steps"""
@@ -20,11 +30,13 @@ class DocumentComposer:
         # Build prompt
         prompt = self._build_prompt(steps, style)
 
-        # Generate document using Gemini
-        response = self.model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
+        # Generate document using Gemini, within the caller's deadline
+        response = await self.hedger.call(
+            lambda: self.model.generate_content_async(
+                prompt,
+                generation_config=genai.types.GenerationConfig(
+                    temperature=0.7,
+                ),
             )
         )
 
@@ -60,6 +72,10 @@ class DocumentComposer:
             # If all else fails, raise an error
             raise ValueError("Could not extract text from Gemini response")
 
+    def estimate_prompt_tokens(self, steps: List[Dict], style: str = "professional") -> int:
+        """Approximate prompt size for these steps"""
+        return estimate_tokens(self._build_prompt(steps, style))
+
     def _build_prompt(self, steps: List[Dict], style: str) -> str:
         """Build prompt for document generation"""
 
@@ -1,9 +1,23 @@
 import os
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 import google.generativeai as genai
-from typing import List, Dict
+from typing import List, Dict, Optional, Any
 import numpy as np
 
 
+# Default pooling weight per event type; page changes say little about a guide
+EVENT_WEIGHTS = {
+    "click": 1.0,
+    "input": 1.0,
+    "navigation": 0.8,
+    "dom_change": 0.2,
+}
+
+
 class EmbeddingService:
     """Embedding service for search using Google's text-embedding-004"""
 
@@ -14,47 +28,46 @@ class EmbeddingService:
         genai.configure(api_key=api_key)
         # Use text-embedding-004 model for embeddings
         self.embedding_model = 'models/text-embedding-004'
+        # Step vectors keyed by embedded text, so unchanged steps cost no API call
+        self.cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
 
     async def generate_embeddings(self, steps: List[Dict]) -> List[List[float]]:
         """Generate embeddings for steps using Google's embedding model"""
 
         # Combine step descriptions
-        texts = [
-            f"{step.get('description', '')} {step.get('domEvent', {}).get('type', '')}"
-            for step in steps
-        ]
+        texts = [self._step_text(step) for step in steps]
 
         # Generate embeddings using Google's embedding API
         embeddings = []
         for text in texts:
-            result = genai.embed_content(
-                model=self.embedding_model,
-                content=text,
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-            # Handle both dict and object responses
-            if isinstance(result, dict):
-                embeddings.append(result['embedding'])
-            else:
-                embeddings.append(result.embedding)
+            embeddings.append(self._embed(text))
 
         return embeddings
 
-    async def generate_guide_embedding(self, guide: Dict) -> List[float]:
-        """Generate embedding for entire guide"""
+    async def generate_step_embedding(self, step: Dict) -> List[float]:
+        """Embed a single step without blocking the event loop"""
+        text = self._step_text(step)
+        cached = self.cache.get(text)
+        if cached is not None:
+            self.cache.move_to_end(text)
+            return cached
+        embedding = await asyncio.to_thread(self._embed, text)
+        self.cache[text] = embedding
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return embedding
 
-        # Combine all step descriptions
-        text = "\n".join([
-            step.get("description", "")
-            for step in guide.get("steps", [])
-        ])
+    @staticmethod
+    def _step_text(step: Dict) -> str:
+        return f"{step.get('description', '')} {(step.get('domEvent') or {}).get('type', '')}"
 
+    def _embed(self, text: str) -> List[float]:
         result = genai.embed_content(
             model=self.embedding_model,
             content=text,
             task_type="RETRIEVAL_DOCUMENT"
         )
-
         # Handle both dict and object responses
         if isinstance(result, dict):
             return result['embedding']
@@ -62,3 +75,227 @@ class EmbeddingService:
             return result.embedding
 
 
+def step_weight(step: Dict) -> float:
+    """Pooling weight for a step: explicit `weight`, else by event type"""
+    if step.get("weight") is not None:
+        return float(step["weight"])
+    event = step.get("domEvent") or {}
+    return EVENT_WEIGHTS.get(event.get("type"), 1.0)
+
+
+class GuideEmbedding:
+    """Guide vector as the normalized weighted mean of its step vectors
+
+    Keeps the weighted sum and total weight, so adding, editing or
+    removing a step is O(dim) and needs no embedding call.
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, tuple] = {}
+        self.sum: Optional[np.ndarray] = None
+        self.total_weight = 0.0
+
+    def upsert(self, step_id: str, vector: List[float], weight: float = 1.0):
+        if weight < 0:
+            raise ValueError("Step weight must be non-negative")
+        unit = self._normalize(np.asarray(vector, dtype=np.float64))
+        existing = self.steps.get(step_id)
+        if self.sum is not None and unit.shape != self.sum.shape and not (existing and len(self.steps) == 1):
+            raise ValueError(f"Step vector has {unit.shape[0]} dimensions, guide has {self.sum.shape[0]}")
+
+        self.remove(step_id)
+        if self.sum is None:
+            self.sum = np.zeros_like(unit)
+        self.steps[step_id] = (unit, weight)
+        self.sum += weight * unit
+        self.total_weight += weight
+
+    def remove(self, step_id: str) -> bool:
+        previous = self.steps.pop(step_id, None)
+        if previous is None:
+            return False
+        unit, weight = previous
+        self.sum -= weight * unit
+        self.total_weight -= weight
+        if not self.steps:
+            # Start clean rather than carry floating point residue
+            self.sum = None
+            self.total_weight = 0.0
+        return True
+
+    def vector(self) -> List[float]:
+        if self.sum is None or self.total_weight <= 0:
+            return []
+        return self._normalize(self.sum / self.total_weight).tolist()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "steps": len(self.steps),
+            "totalWeight": round(self.total_weight, 6),
+            "dimensions": int(self.sum.shape[0]) if self.sum is not None else 0,
+            "embedding": self.vector(),
+        }
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class GuideEmbeddingStore:
+    """Pooled guide vectors persisted in SQLite
+
+    Each guide keeps its weighted sum and total weight, and each step its
+    unit vector and weight. Adding, editing or removing a step reads and
+    writes one step row and one guide row: O(dim), no embedding call, and
+    nothing held in memory between requests.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS guide_embeddings (
+                guide_id TEXT PRIMARY KEY,
+                sum BLOB NOT NULL,
+                total_weight REAL NOT NULL,
+                steps INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS guide_step_embeddings (
+                guide_id TEXT NOT NULL,
+                step_id TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (guide_id, step_id)
+            )
+            """
+        )
+
+    def get(self, guide_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._load(guide_id)
+        return self._describe(*row) if row is not None else None
+
+    def upsert(self, guide_id: str, step_id: str, vector: List[float], weight: float) -> Dict[str, Any]:
+        if weight < 0:
+            raise ValueError("Step weight must be non-negative")
+        unit = GuideEmbedding._normalize(np.asarray(vector, dtype=np.float64))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                total, total_weight, steps = self._load(guide_id) or (None, 0.0, 0)
+                previous = self._load_step(guide_id, step_id)
+                if previous is not None:
+                    total, total_weight, steps = self._subtract(total, total_weight, steps, *previous)
+                if total is None:
+                    total = np.zeros_like(unit)
+                elif unit.shape != total.shape:
+                    raise ValueError(f"Step vector has {unit.shape[0]} dimensions, guide has {total.shape[0]}")
+
+                total = total + weight * unit
+                total_weight += weight
+                steps += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO guide_step_embeddings (guide_id, step_id, vector, weight) "
+                    "VALUES (?, ?, ?, ?)",
+                    (guide_id, step_id, unit.tobytes(), weight),
+                )
+                self._save(guide_id, total, total_weight, steps)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._describe(total, total_weight, steps)
+
+    def remove(self, guide_id: str, step_id: str) -> Optional[Dict[str, Any]]:
+        """Drop one step; None when the guide has no such step"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self._load_step(guide_id, step_id)
+                row = self._load(guide_id)
+                if previous is None or row is None:
+                    self._db.execute("ROLLBACK")
+                    return None
+                total, total_weight, steps = self._subtract(*row, *previous)
+                self._db.execute(
+                    "DELETE FROM guide_step_embeddings WHERE guide_id = ? AND step_id = ?",
+                    (guide_id, step_id),
+                )
+                self._save(guide_id, total, total_weight, steps)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._describe(total, total_weight, steps)
+
+    def replace(self, guide_id: str, pool: GuideEmbedding) -> Dict[str, Any]:
+        """Store a freshly pooled guide, replacing whatever was there"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM guide_step_embeddings WHERE guide_id = ?", (guide_id,))
+                self._db.executemany(
+                    "INSERT INTO guide_step_embeddings (guide_id, step_id, vector, weight) VALUES (?, ?, ?, ?)",
+                    [(guide_id, step_id, unit.tobytes(), weight) for step_id, (unit, weight) in pool.steps.items()],
+                )
+                self._save(guide_id, pool.sum, pool.total_weight, len(pool.steps))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return pool.describe()
+
+    @staticmethod
+    def _subtract(total, total_weight, steps, unit, weight):
+        steps -= 1
+        if steps <= 0:
+            # Start clean rather than carry floating point residue
+            return None, 0.0, 0
+        return total - weight * unit, total_weight - weight, steps
+
+    def _load(self, guide_id: str):
+        row = self._db.execute(
+            "SELECT sum, total_weight, steps FROM guide_embeddings WHERE guide_id = ?", (guide_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float64).copy(), row[1], row[2]
+
+    def _load_step(self, guide_id: str, step_id: str):
+        row = self._db.execute(
+            "SELECT vector, weight FROM guide_step_embeddings WHERE guide_id = ? AND step_id = ?",
+            (guide_id, step_id),
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float64), row[1]
+
+    def _save(self, guide_id: str, total, total_weight: float, steps: int):
+        if total is None:
+            self._db.execute("DELETE FROM guide_embeddings WHERE guide_id = ?", (guide_id,))
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO guide_embeddings (guide_id, sum, total_weight, steps, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (guide_id, total.tobytes(), total_weight, steps, time.time()),
+        )
+
+    @staticmethod
+    def _describe(total, total_weight: float, steps: int) -> Dict[str, Any]:
+        embedding = []
+        if total is not None and total_weight > 0:
+            embedding = GuideEmbedding._normalize(total / total_weight).tolist()
+        return {
+            "steps": steps,
+            "totalWeight": round(total_weight, 6),
+            "dimensions": int(total.shape[0]) if total is not None else 0,
+            "embedding": embedding,
+        }
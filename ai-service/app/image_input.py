@@ -0,0 +1,137 @@
+import io
+from typing import Union, BinaryIO, Dict, Tuple, Optional
+import httpx
+from fastapi import Request, HTTPException
+from PIL import Image
+
+
+# Raw bytes (downloaded), a file-like object (uploaded/streamed body) or an
+# already decoded image shared between stages
+ImageSource = Union[bytes, BinaryIO, Image.Image]
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    """Open an image from bytes or a file-like object without copying it"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    source.seek(0)
+    return Image.open(source)
+
+
+def read_bytes(source: ImageSource) -> bytes:
+    """Materialize an image source as bytes (for APIs that need a buffer)"""
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, Image.Image):
+        output = io.BytesIO()
+        source.save(output, format="PNG")
+        return output.getvalue()
+    source.seek(0)
+    return source.read()
+
+
+def _too_large(size: int, max_bytes: Optional[int]) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Image is over {max_bytes} bytes (got {size})")
+
+
+async def download_image(uri: str, max_bytes: Optional[int] = None) -> bytes:
+    """Download an image, turning fetch failures into HTTP errors
+
+    An unusable URI or a 4xx from the image host (missing object, expired
+    signature) is the caller's 400; an unreachable host or a 5xx is a 502.
+    """
+    try:
+        return await _fetch(uri, max_bytes)
+    except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid screenshotUri: {e}")
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        raise HTTPException(
+            status_code=400 if status < 500 else 502,
+            detail=f"Fetching screenshotUri failed with HTTP {status}",
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Could not fetch screenshotUri: {e}")
+
+
+async def _fetch(uri: str, max_bytes: Optional[int]) -> bytes:
+    async with httpx.AsyncClient() as client:
+        if max_bytes is None:
+            response = await client.get(uri)
+            response.raise_for_status()
+            return response.content
+
+        # Stream so an oversized image is abandoned before it is buffered
+        async with client.stream("GET", uri) as response:
+            response.raise_for_status()
+            declared = int(response.headers.get("content-length") or 0)
+            if declared > max_bytes:
+                raise _too_large(declared, max_bytes)
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > max_bytes:
+                    raise _too_large(len(body), max_bytes)
+            return bytes(body)
+
+
+async def read_image_request(
+    request: Request,
+    file_field: str = "screenshot",
+    require_image: bool = True,
+    max_bytes: Optional[int] = None,
+) -> Tuple[Dict, Optional[ImageSource]]:
+    """Read request fields and the image from JSON, multipart or raw bodies
+
+    - application/json: fields from the body, image downloaded from screenshotUri
+    - multipart/form-data: fields from the form, image from the `file_field` part
+    - image/* or application/octet-stream: image is the body, fields from
+      the query string
+
+    With require_image=False, JSON and multipart requests without an image
+    return None as the source. Images over `max_bytes` are rejected with 413.
+    """
+
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        fields = {key: value for key, value in form.items() if key != file_field}
+        upload = form.get(file_field)
+        if upload is not None and not isinstance(upload, str):
+            if max_bytes is not None and upload.size is not None and upload.size > max_bytes:
+                raise _too_large(upload.size, max_bytes)
+            # Decode straight from the spooled upload; no extra copy
+            return fields, upload.file
+        if fields.get("screenshotUri"):
+            return fields, await download_image(fields["screenshotUri"], max_bytes)
+        if not require_image:
+            return fields, None
+        raise HTTPException(status_code=400, detail=f"Missing '{file_field}' file or screenshotUri")
+
+    if content_type.startswith("image/") or content_type.startswith("application/octet-stream"):
+        body = io.BytesIO()
+        async for chunk in request.stream():
+            body.write(chunk)
+            if max_bytes is not None and body.tell() > max_bytes:
+                raise _too_large(body.tell(), max_bytes)
+        if body.tell() == 0:
+            raise HTTPException(status_code=400, detail="Empty image body")
+        body.seek(0)
+        return dict(request.query_params), body
+
+    try:
+        fields = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected a JSON, multipart or image body")
+    if not isinstance(fields, dict):
+        raise HTTPException(status_code=400, detail="Expected a JSON object")
+    if fields.get("screenshotUri"):
+        return fields, await download_image(fields["screenshotUri"], max_bytes)
+    if not require_image:
+        return fields, None
+    raise HTTPException(status_code=400, detail="screenshotUri is required for JSON requests")
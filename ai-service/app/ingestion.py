@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import math
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional, TypeVar
+from PIL import Image
+
+from app.image_input import ImageSource, open_image
+
+
+class ImageRejected(Exception):
+    """An image can't be admitted; carries the HTTP status to return"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+T = TypeVar("T")
+
+
+class _Reservation:
+    """Decode memory held for one admitted image
+
+    Released once the admit block has exited and every worker thread
+    started inside it has returned: a thread whose await was abandoned (a
+    deadline, a cancelled OCR hedge) still holds the frame until it ends.
+    Only touched from the event loop thread.
+    """
+
+    def __init__(self, release: Callable[[], Awaitable[None]]):
+        self._release = release
+        self.threads = 0
+        self.closed = False
+
+    def thread_started(self):
+        self.threads += 1
+
+    def thread_finished(self):
+        self.threads -= 1
+        if self.closed and self.threads == 0:
+            asyncio.ensure_future(self._release())
+
+    async def close(self):
+        self.closed = True
+        if self.threads == 0:
+            await self._release()
+
+
+_reservation: contextvars.ContextVar[Optional[_Reservation]] = contextvars.ContextVar(
+    "image_reservation", default=None
+)
+
+
+async def run_in_thread(func: Callable[..., T], *args: Any) -> T:
+    """asyncio.to_thread that keeps the current image's reservation until the thread returns
+
+    Use it for blocking work on an admitted image, so the decode budget
+    stays charged while a thread still holds the pixels.
+    """
+
+    reservation = _reservation.get()
+    if reservation is None:
+        return await asyncio.to_thread(func, *args)
+
+    loop = asyncio.get_running_loop()
+
+    def run():
+        try:
+            return func(*args)
+        finally:
+            try:
+                loop.call_soon_threadsafe(reservation.thread_finished)
+            except RuntimeError:
+                pass  # Loop already closed (shutdown)
+
+    reservation.thread_started()
+    return await asyncio.to_thread(run)
+
+
+class ImageBudget:
+    """Admission control for decoding images.
+
+    Each image is sized from its header before any pixels are decoded:
+    - Encoded payloads over `max_bytes` are rejected (413).
+    - Images over `max_pixels` are decoded at reduced size via JPEG draft
+      mode when allowed, and rejected (413) otherwise.
+    - The decoded cost (pixels x bands x `decode_overhead` for working
+      copies) is reserved from a global `budget_bytes` pool. Requests wait
+      up to `queue_timeout` seconds for room, then get 503. The reservation
+      lasts until the admit block exits and every `run_in_thread` worker
+      started inside it has returned.
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int,
+        max_bytes: int,
+        max_pixels: int,
+        queue_timeout: float = 10.0,
+        decode_overhead: float = 2.0,
+    ):
+        self.budget_bytes = budget_bytes
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.queue_timeout = queue_timeout
+        self.decode_overhead = decode_overhead
+        self._condition = asyncio.Condition()
+
+        self.in_flight_bytes = 0
+        self.in_flight_images = 0
+        self.peak_bytes = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.drafted = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self, source: ImageSource, allow_draft: bool = True) -> AsyncIterator[ImageSource]:
+        """Reserve decode memory for an image for the duration of the block
+
+        Yields the source to decode: the original one, or a lazily opened
+        image already switched to draft (reduced) decoding, with its original
+        size in `info["source_size"]`. A None source
+        (no image) passes through without a reservation.
+        """
+
+        if source is None:
+            yield None
+            return
+
+        try:
+            image = open_image(source)
+        except Image.DecompressionBombError as e:
+            self.rejected += 1
+            raise ImageRejected(413, str(e))
+        except Exception as e:
+            raise ImageRejected(400, f"Unreadable image: {e}")
+
+        drafted = False
+        width, height = image.size
+        if width * height > self.max_pixels:
+            if allow_draft and image.format == "JPEG":
+                # JPEG can decode directly at 1/2, 1/4 or 1/8 scale; draft()
+                # only picks among those, so round up to one of them
+                needed = math.sqrt(width * height / float(self.max_pixels))
+                scale = min(8, 2 ** math.ceil(math.log2(needed)))
+                mode = image.mode if image.mode in ("RGB", "L") else "RGB"
+                image.draft(mode, (width // scale, height // scale))
+                # Lets OCR map boxes on the reduced decode back to the source
+                image.info["source_size"] = (width, height)
+                width, height = image.size
+                drafted = True
+            if width * height > self.max_pixels:
+                self.rejected += 1
+                raise ImageRejected(
+                    413, f"Image is {width}x{height} pixels, limit is {self.max_pixels}"
+                )
+
+        bands = len(image.getbands())
+        cost = int(width * height * bands * self.decode_overhead)
+        if cost > self.budget_bytes:
+            self.rejected += 1
+            raise ImageRejected(413, f"Image needs {cost} bytes to decode, budget is {self.budget_bytes}")
+
+        await self._acquire(cost)
+        if drafted:
+            self.drafted += 1
+        reservation = _Reservation(lambda: self._release(cost))
+        token = _reservation.set(reservation)
+        try:
+            yield image if drafted else source
+        finally:
+            _reservation.reset(token)
+            await reservation.close()
+
+    async def _acquire(self, cost: int):
+        async with self._condition:
+            if self.in_flight_bytes + cost > self.budget_bytes:
+                self.queued += 1
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: self.in_flight_bytes + cost <= self.budget_bytes),
+                        timeout=self.queue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise ImageRejected(503, "Image decode budget exhausted, retry later")
+                finally:
+                    self.waiting -= 1
+
+            self.in_flight_bytes += cost
+            self.in_flight_images += 1
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+            self.admitted += 1
+
+    async def _release(self, cost: int):
+        async with self._condition:
+            self.in_flight_bytes -= cost
+            self.in_flight_images -= 1
+            self._condition.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "budgetBytes": self.budget_bytes,
+            "inFlightBytes": self.in_flight_bytes,
+            "inFlightImages": self.in_flight_images,
+            "peakBytes": self.peak_bytes,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "drafted": self.drafted,
+            "rejected": self.rejected,
+            "maxBytes": self.max_bytes,
+            "maxPixels": self.max_pixels,
+        }
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different job"""
+
+
+class JobStore:
+    """Durable job records in a local SQLite database"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                idempotency_key TEXT UNIQUE,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL,
+                expires_at REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def create(self, kind: str, payload: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        """Insert a queued job, or return the existing job for the same key
+
+        Raises IdempotencyConflict when the key belongs to a job with a
+        different kind or payload.
+        """
+        now = time.time()
+        with self._lock:
+            if idempotency_key:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if row is not None:
+                    # Compare as stored, so key order and tuples vs lists don't matter
+                    if row["kind"] != kind or json.loads(row["payload"]) != json.loads(json.dumps(payload)):
+                        raise IdempotencyConflict(
+                            f"Idempotency key already belongs to {row['kind']} job {row['id']}; "
+                            "retries must resend the same kind and payload"
+                        )
+                    return self._to_dict(row)
+            job_id = str(uuid.uuid4())
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, payload, idempotency_key, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), idempotency_key, now, now),
+            )
+            return self._get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._get(job_id)
+
+    def claim_next(self) -> Optional[Dict]:
+        """Move the oldest queued job to running and return it with its payload"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, time.time(), row["id"]),
+            )
+            job = self._get(row["id"])
+            job["payload"] = json.loads(row["payload"])
+            return job
+
+    def finish(self, job_id: str, ttl: float, result: Any = None, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, "
+                "finished_at = ?, expires_at = ? WHERE id = ?",
+                (
+                    FAILED if error is not None else SUCCEEDED,
+                    json.dumps(result) if error is None else None,
+                    error,
+                    now,
+                    now,
+                    now + ttl,
+                    job_id,
+                ),
+            )
+
+    def recover(self, max_attempts: int, ttl: float) -> int:
+        """Requeue jobs left running by a previous process; give up on repeat offenders"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ?, expires_at = ? "
+                "WHERE status = ? AND attempts >= ?",
+                (FAILED, "Interrupted too many times", now, now, now + ttl, RUNNING, max_attempts),
+            )
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (QUEUED, now, RUNNING),
+            )
+            return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
+            return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+            return {row["status"]: row["n"] for row in rows}
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+            "finishedAt": row["finished_at"],
+            "expiresAt": row["expires_at"],
+        }
+
+
+class JobQueue:
+    """Worker loop over a JobStore with bounded concurrency.
+
+    Jobs survive restarts: anything left running is requeued on start.
+    Finished jobs (and their idempotency keys) are kept for `result_ttl`
+    seconds. Callers can long-poll a job with `wait`.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Callable[[Dict], Awaitable[Any]]],
+        concurrency: int = 2,
+        result_ttl: float = 24 * 3600,
+        max_attempts: int = 3,
+        poll_interval: float = 1.0,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        # One event per long-poller, so a poller never drops another's wakeup
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._tasks = []
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        recovered = await asyncio.to_thread(self.store.recover, self.max_attempts, self.result_ttl)
+        if recovered:
+            print(f"[Jobs] Requeued {recovered} interrupted jobs")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, kind: str, payload: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}', expected one of {sorted(self.handlers)}")
+        job = await asyncio.to_thread(self.store.create, kind, payload, idempotency_key)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """Return a job, waiting up to `wait` seconds for it to finish"""
+        if wait <= 0:
+            return await asyncio.to_thread(self.store.get, job_id)
+
+        # Register before reading so a job finishing in between still wakes us
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(job_id, set())
+        waiters.add(event)
+        try:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None or job["status"] in (SUCCEEDED, FAILED):
+                return job
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            return await asyncio.to_thread(self.store.get, job_id)
+        finally:
+            waiters.discard(event)
+            if not waiters and self._waiters.get(job_id) is waiters:
+                del self._waiters[job_id]
+
+    async def _worker(self, index: int):
+        while True:
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            started = time.perf_counter()
+            print(f"[Jobs] Worker {index} running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+            try:
+                result = await self.handlers[job["kind"]](job["payload"])
+                await asyncio.to_thread(self.store.finish, job["id"], self.result_ttl, result)
+                print(f"[Jobs] Job {job['id']} succeeded in {time.perf_counter() - started:.1f}s")
+            except asyncio.CancelledError:
+                # Shutting down: the job stays running and is requeued on restart
+                raise
+            except Exception as e:
+                print(f"[Jobs] Job {job['id']} failed: {type(e).__name__}: {e}")
+                await asyncio.to_thread(self.store.finish, job["id"], self.result_ttl, None, str(e))
+
+            for event in self._waiters.pop(job["id"], ()):
+                event.set()
+
+    async def _janitor(self):
+        while True:
+            await asyncio.sleep(60)
+            try:
+                purged = await asyncio.to_thread(self.store.purge_expired)
+                if purged:
+                    print(f"[Jobs] Purged {purged} expired jobs")
+            except Exception as e:
+                print(f"[Jobs] Purge failed: {e}")
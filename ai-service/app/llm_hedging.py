@@ -0,0 +1,184 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Optional, Any
+
+
+# Milliseconds the caller is still willing to wait for the response
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The caller's deadline passed before a response was ready"""
+
+
+def set_deadline(timeout_ms: Optional[float]):
+    """Start the deadline for the current request context; returns a reset token"""
+    if timeout_ms is None:
+        return _deadline.set(None)
+    return _deadline.set(time.monotonic() + timeout_ms / 1000.0)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+# Stages stop this long before the deadline so a partial result can still
+# be serialized and sent in time
+DEADLINE_MARGIN = 0.25
+
+
+async def within_deadline(awaitable: Awaitable[Any], what: str, margin: float = 0.0) -> Any:
+    """Await under the current deadline, raising DeadlineExceeded when it passes
+
+    Work already handed to a thread keeps running; only the wait is cut.
+    """
+    left = remaining()
+    if left is None:
+        return await awaitable
+    left -= margin
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(f"{what}: deadline passed before it started")
+    try:
+        return await asyncio.wait_for(awaitable, timeout=left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{what}: deadline passed")
+
+
+class LLMHedger:
+    """Deadline-aware LLM calls with optional hedging.
+
+    Calls are cancelled when the request deadline passes. With hedging on,
+    a duplicate request is sent if the first hasn't answered by the
+    observed p95 latency; the first success wins and the other is
+    cancelled. Hedges draw from a budget that refills by `max_hedge_ratio`
+    per request (up to `burst`), capping the extra spend at roughly that
+    fraction of traffic.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        hedging: bool = True,
+        hedge_default_ms: float = 4000.0,
+        max_hedge_ratio: float = 0.1,
+        burst: float = 5.0,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.name = name
+        self.hedging = hedging
+        self.hedge_default_ms = hedge_default_ms
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.budget = burst
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_skipped = 0
+        self.deadline_exceeded = 0
+        self.failures = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self) -> float:
+        p95 = self.p95()
+        return max(0.1, (p95 if p95 is not None else self.hedge_default_ms) / 1000.0)
+
+    async def call(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `attempt()`, hedging it if it runs long
+
+        `attempt` must start a fresh request each time it is called.
+        """
+
+        self.requests += 1
+        self.budget = min(self.burst, self.budget + self.max_hedge_ratio)
+        left = remaining()
+        if left is not None and left <= 0:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"{self.name}: deadline passed before the call started")
+
+        tasks = {asyncio.ensure_future(self._timed(attempt)): "primary"}
+        try:
+            if self.hedging:
+                delay = self.hedge_delay()
+                left = remaining()
+                if left is None or delay < left:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done:
+                        if self.budget >= 1.0:
+                            self.budget -= 1.0
+                            self.hedges += 1
+                            print(f"[LLMHedger] {self.name} past {delay * 1000:.0f}ms, sending hedge")
+                            tasks[asyncio.ensure_future(self._timed(attempt))] = "hedge"
+                        else:
+                            self.budget_skipped += 1
+
+            last_error = None
+            pending = set(tasks)
+            while pending:
+                left = remaining()
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, left) if left is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self.deadline_exceeded += 1
+                    raise DeadlineExceeded(f"{self.name}: deadline passed waiting for the model")
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] == "hedge":
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+
+            self.failures += 1
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _timed(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await attempt()
+        except asyncio.CancelledError:
+            # Lost the race or ran out of time: it took at least this long
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            raise
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "hedging": self.hedging,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedgeRate": round(self.hedges / self.requests, 3) if self.requests else 0.0,
+            "hedgeWins": self.hedge_wins,
+            "winRate": round(self.hedge_wins / self.hedges, 3) if self.hedges else 0.0,
+            "budgetSkipped": self.budget_skipped,
+            "deadlineExceeded": self.deadline_exceeded,
+            "failures": self.failures,
+            "p95LatencyMs": round(p95, 1) if p95 is not None else None,
+            "hedgeDelayMs": round(self.hedge_delay() * 1000, 1),
+        }
@@ -1,21 +1,37 @@
 import os
-from typing import Optional
+import time
+from bisect import bisect_right
+from typing import Optional, List, Dict
 import pytesseract
 from PIL import Image
-import io
-import httpx
+import numpy as np
+
+from app.image_input import ImageSource, open_image, read_bytes
+from app.ingestion import run_in_thread
+from app.text_regions import TextRegionDetector, build_batches, BATCH_PADDING
+from app.ocr_router import OCRRouter, BackendStats
 
 try:
-    from google.cloud import vision
+    from app.vision_batcher import VisionBatcher
     GOOGLE_VISION_AVAILABLE = True
 except ImportError:
     GOOGLE_VISION_AVAILABLE = False
 
 
 class OCRResult:
-    def __init__(self, text: str, confidence: float):
+    def __init__(
+        self,
+        text: str,
+        confidence: float,
+        regions: Optional[List[Dict]] = None,
+        words: Optional[List[Dict]] = None,
+    ):
         self.text = text
         self.confidence = confidence
+        # Text regions that were OCR'd (None when the full frame was used)
+        self.regions = regions
+        # Word-level boxes in source image coordinates, when available
+        self.words = words or []
 
 
 class OCRService:
@@ -23,71 +39,209 @@ class OCRService:
 
     def __init__(self):
         self.use_google_vision = (
-            GOOGLE_VISION_AVAILABLE and
-            os.getenv("GOOGLE_VISION_API_KEY") is not None
+            GOOGLE_VISION_AVAILABLE and (
+                os.getenv("GOOGLE_VISION_API_KEY") is not None or
+                bool(os.getenv("GOOGLE_VISION_ENDPOINT"))
+            )
         )
 
-        self.vision_client = None
+        # Async Vision client behind a micro-batcher: concurrent requests
+        # share batch_annotate_images RPCs
+        self.vision_batcher = None
         if self.use_google_vision:
             try:
-                self.vision_client = vision.ImageAnnotatorClient()
+                self.vision_batcher = VisionBatcher(
+                    window_ms=float(os.getenv("VISION_BATCH_WINDOW_MS", "20")),
+                    max_batch=int(os.getenv("VISION_MAX_BATCH", "16")),
+                )
             except Exception as e:
                 print(f"[OCR] Failed to initialize Google Vision, falling back to Tesseract: {e}")
                 self.use_google_vision = False
 
-    async def extract_text(self, image_bytes: bytes) -> OCRResult:
-        """Extract text from image using OCR"""
-
-        if self.use_google_vision:
-            return await self._extract_with_google_vision(image_bytes)
+        # Detect text regions first and OCR only those crops with Tesseract
+        self.region_detector = None
+        if os.getenv("OCR_TEXT_REGIONS", "true").lower() != "false":
+            self.region_detector = TextRegionDetector()
+        # Above this fraction of the frame, cropping saves nothing
+        self.max_region_coverage = float(os.getenv("OCR_MAX_REGION_COVERAGE", "0.6"))
+
+        # With both backends available, route each image by live latency
+        self.router = None
+        if self.use_google_vision and os.getenv("OCR_ROUTER", "true").lower() != "false":
+            self.router = OCRRouter(
+                backends={
+                    "google_vision": self._vision,
+                    "tesseract": self._tesseract_async,
+                },
+                stats={
+                    "google_vision": BackendStats(
+                        "google_vision", prior_latency_ms=800, prior_quality=0.95, capacity=32,
+                    ),
+                    "tesseract": BackendStats(
+                        "tesseract", prior_latency_ms=1500, prior_quality=0.8,
+                        capacity=os.cpu_count() or 1,
+                    ),
+                },
+                fallback="tesseract",
+                min_quality=float(os.getenv("OCR_MIN_QUALITY", "0.0")),
+                hedge_default_ms=float(os.getenv("OCR_HEDGE_DEFAULT_MS", "3000")),
+                hedging=os.getenv("OCR_HEDGING", "true").lower() != "false",
+            )
+
+    async def extract_text(self, image_source: ImageSource) -> OCRResult:
+        """Extract text from image using OCR
+
+        Boxes are in source image coordinates, also when the image was
+        draft-decoded at reduced size (see ImageBudget.admit).
+        """
+
+        source_size = image_source.info.get("source_size") if isinstance(image_source, Image.Image) else None
+        decoded_size = image_source.size if source_size else None
+        result = await self._extract(image_source)
+        if source_size and source_size != decoded_size:
+            self._scale_boxes(result, source_size[0] / decoded_size[0], source_size[1] / decoded_size[1])
+        return result
+
+    @staticmethod
+    def _scale_boxes(result: OCRResult, scale_x: float, scale_y: float):
+        for box in (result.regions or []) + result.words:
+            box["x"] = int(round(box["x"] * scale_x))
+            box["y"] = int(round(box["y"] * scale_y))
+            box["width"] = int(round(box["width"] * scale_x))
+            box["height"] = int(round(box["height"] * scale_y))
+
+    async def _extract(self, image_source: ImageSource) -> OCRResult:
+        if self.router is not None:
+            # A hedged request reads the image from two threads at once,
+            # which a shared file object or lazily decoded image can't support
+            if isinstance(image_source, Image.Image):
+                await run_in_thread(image_source.load)
+            else:
+                image_source = read_bytes(image_source)
+            try:
+                return await self.router.extract(image_source)
+            except Exception as e:
+                print(f"[OCR] All OCR backends failed: {e}")
+                return OCRResult("", 0.0)
+        elif self.use_google_vision:
+            return await self._extract_with_google_vision(image_source)
         else:
-            return await self._extract_with_tesseract(image_bytes)
+            return await self._extract_with_tesseract(image_source)
 
-    async def _extract_with_tesseract(self, image_bytes: bytes) -> OCRResult:
+    async def _extract_with_tesseract(self, image_source: ImageSource) -> OCRResult:
         """Extract text using Tesseract OCR"""
+        # Tesseract is CPU-bound; run it off the event loop so concurrent
+        # requests (and pipelined batch stages) can overlap
+        return await run_in_thread(self._run_tesseract, image_source)
+
+    async def _tesseract_async(self, image_source: ImageSource) -> OCRResult:
+        """Tesseract without the error fallback, for the router"""
+        return await run_in_thread(self._tesseract, image_source)
+
+    def _run_tesseract(self, image_source: ImageSource) -> OCRResult:
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            text = pytesseract.image_to_string(image)
-            # Get confidence (average)
-            data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-            confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-            avg_confidence = sum(confidences) / len(confidences) / 100.0 if confidences else 0.0
-
-            return OCRResult(text.strip(), avg_confidence)
+            return self._tesseract(image_source)
         except Exception as e:
             print(f"[OCR] Tesseract error: {e}")
             return OCRResult("", 0.0)
 
-    async def _extract_with_google_vision(self, image_bytes: bytes) -> OCRResult:
+    def _tesseract(self, image_source: ImageSource) -> OCRResult:
+        image = open_image(image_source)
+
+        if self.region_detector is not None:
+            result = self._extract_text_regions(image)
+            if result is not None:
+                return result
+
+        text = pytesseract.image_to_string(image)
+        # Get confidence (average)
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+        confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+        avg_confidence = sum(confidences) / len(confidences) / 100.0 if confidences else 0.0
+
+        return OCRResult(text.strip(), avg_confidence)
+
+    def _extract_text_regions(self, image: Image.Image) -> Optional[OCRResult]:
+        """OCR only detected text regions, batched into stacked strips.
+
+        Returns None when the regions cover most of the frame, in which case
+        a full-frame pass is cheaper.
+        """
+        started = time.perf_counter()
+        gray = np.array(image.convert("L"))
+        regions = self.region_detector.detect(gray)
+        detect_ms = (time.perf_counter() - started) * 1000
+
+        if not regions:
+            print(f"[OCR] No text regions detected ({detect_ms:.1f}ms), skipping OCR")
+            return OCRResult("", 0.0, regions=[])
+
+        covered = sum(r["width"] * r["height"] for r in regions)
+        coverage = covered / float(gray.shape[0] * gray.shape[1])
+        if coverage > self.max_region_coverage:
+            print(f"[OCR] Text regions cover {coverage:.0%} of frame, using full frame")
+            return None
+
+        lines: List[str] = []
+        words: List[Dict] = []
+        confidences: List[float] = []
+        for canvas, strips in build_batches(gray, regions):
+            data = pytesseract.image_to_data(canvas, output_type=pytesseract.Output.DICT)
+            tops = [top for top, _ in strips]
+            line_keys = []
+            line_words: Dict[tuple, List[str]] = {}
+
+            for i, word in enumerate(data["text"]):
+                word = word.strip()
+                conf = float(data["conf"][i])
+                if not word or conf < 0:
+                    continue
+                strip_index = max(0, bisect_right(tops, data["top"][i]) - 1)
+                strip_top, region = strips[strip_index]
+                key = (strip_index, data["block_num"][i], data["par_num"][i], data["line_num"][i])
+                if key not in line_words:
+                    line_words[key] = []
+                    line_keys.append(key)
+                line_words[key].append(word)
+
+                words.append({
+                    "text": word,
+                    "confidence": conf / 100.0,
+                    "x": region["x"] + data["left"][i] - BATCH_PADDING,
+                    "y": region["y"] + data["top"][i] - strip_top,
+                    "width": data["width"][i],
+                    "height": data["height"][i],
+                })
+                if conf > 0:
+                    confidences.append(conf)
+
+            for key in sorted(line_keys):
+                lines.append(" ".join(line_words[key]))
+
+        avg_confidence = sum(confidences) / len(confidences) / 100.0 if confidences else 0.0
+        total_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"[OCR] Tesseract on {len(regions)} regions ({coverage:.0%} of frame): "
+            f"detect {detect_ms:.1f}ms, total {total_ms:.1f}ms"
+        )
+        return OCRResult("\n".join(lines), avg_confidence, regions=regions, words=words)
+
+    async def _extract_with_google_vision(self, image_source: ImageSource) -> OCRResult:
         """Extract text using Google Vision API"""
         try:
-            if self.vision_client is None:
-                raise Exception("Vision client not initialized")
-            image = vision.Image(content=image_bytes)
-            response = self.vision_client.text_detection(image=image)
-            texts = response.text_annotations
-
-            if texts:
-                text = texts[0].description
-                # Calculate average confidence
-                confidences = [
-                    annotation.confidence
-                    for annotation in texts[1:]
-                    if annotation.confidence > 0
-                ]
-                avg_confidence = (
-                    sum(confidences) / len(confidences)
-                    if confidences
-                    else 0.9
-                )
-                return OCRResult(text, avg_confidence)
-            else:
-                return OCRResult("", 0.0)
+            return await self._vision(image_source)
         except Exception as e:
             print(f"[OCR] Google Vision error: {e}")
-            # Fallback to Tesseract
-            return await self._extract_with_tesseract(image_bytes)
-
-
-
-
+            # Fallback to Tesseract for this image only
+            return await self._extract_with_tesseract(image_source)
+
+    async def _vision(self, image_source: ImageSource) -> OCRResult:
+        """Google Vision without the Tesseract fallback, for the router"""
+        if self.vision_batcher is None:
+            raise Exception("Vision client not initialized")
+        annotation = await self.vision_batcher.annotate(read_bytes(image_source))
+        return OCRResult(
+            annotation["text"],
+            annotation["confidence"],
+            words=annotation["words"],
+        )
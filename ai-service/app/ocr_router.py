@@ -0,0 +1,293 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Awaitable, Dict, List, Optional, Any
+
+
+class CircuitBreaker:
+    """Stops sending traffic to a backend that keeps failing.
+
+    Opens when the error rate over the recent window exceeds `error_rate`
+    (with at least `min_samples` calls) or after `max_consecutive` failures
+    in a row. After `cooldown` seconds it lets a single probe through
+    (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        error_rate: float = 0.5,
+        min_samples: int = 10,
+        max_consecutive: int = 5,
+        cooldown: float = 30.0,
+        window: int = 50,
+    ):
+        self.error_rate = error_rate
+        self.min_samples = min_samples
+        self.max_consecutive = max_consecutive
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self.probe_in_flight:
+            return True
+        return False
+
+    def would_allow(self) -> bool:
+        """Same answer as allow(), without moving OPEN to HALF_OPEN"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.probe_in_flight
+
+    def on_start(self):
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+
+    def on_cancel(self):
+        # A cancelled probe proves nothing; let the next call probe instead
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = False
+
+    def record(self, success: bool):
+        self.outcomes.append(success)
+        if success:
+            self.consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self.outcomes.clear()
+            return
+
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+        failures = self.outcomes.count(False)
+        if self.consecutive_failures >= self.max_consecutive or (
+            len(self.outcomes) >= self.min_samples and failures / len(self.outcomes) > self.error_rate
+        ):
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+
+class BackendStats:
+    """Rolling latency, error, confidence and queue-depth stats for a backend"""
+
+    def __init__(
+        self,
+        name: str,
+        prior_latency_ms: float,
+        prior_quality: float,
+        capacity: int,
+        window: int = 100,
+        error_horizon: float = 60.0,
+    ):
+        self.name = name
+        self.prior_latency_ms = prior_latency_ms
+        self.prior_quality = prior_quality
+        self.capacity = max(1, capacity)
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+        self.confidences = deque(maxlen=window)
+        # Errors older than this stop counting, so a recovered backend that
+        # lost all its traffic becomes attractive again
+        self.error_horizon = error_horizon
+        self.in_flight = 0
+        self.breaker = CircuitBreaker()
+
+    def record(self, latency_ms: float, success: bool, confidence: Optional[float] = None):
+        self.errors.append((time.monotonic(), not success))
+        if success:
+            self.latencies.append(latency_ms)
+            if confidence is not None and confidence > 0:
+                self.confidences.append(confidence)
+        self.breaker.record(success)
+
+    def record_censored(self, latency_ms: float):
+        """A call cancelled after `latency_ms` took at least that long"""
+        self.latencies.append(latency_ms)
+
+    def mean_latency(self) -> float:
+        if not self.latencies:
+            return self.prior_latency_ms
+        return sum(self.latencies) / len(self.latencies)
+
+    def p95(self, min_samples: int = 20) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self) -> float:
+        cutoff = time.monotonic() - self.error_horizon
+        recent = [failed for at, failed in self.errors if at >= cutoff]
+        return sum(recent) / len(recent) if recent else 0.0
+
+    def quality(self) -> float:
+        if len(self.confidences) < 5:
+            return self.prior_quality
+        return sum(self.confidences) / len(self.confidences)
+
+    def expected_latency(self) -> float:
+        """Mean service time, inflated by queueing and by the retry cost of errors"""
+        queueing = 1.0 + self.in_flight / float(self.capacity)
+        return self.mean_latency() * queueing / max(0.05, 1.0 - self.error_rate())
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "meanLatencyMs": round(self.mean_latency(), 1),
+            "p95LatencyMs": round(p95, 1) if p95 is not None else None,
+            "expectedLatencyMs": round(self.expected_latency(), 1),
+            "errorRate": round(self.error_rate(), 3),
+            "quality": round(self.quality(), 3),
+            "inFlight": self.in_flight,
+            "samples": len(self.latencies),
+            "breaker": self.breaker.state,
+        }
+
+
+class OCRRouter:
+    """Sends each image to the OCR backend with the best expected latency.
+
+    Backends below `min_quality` are skipped while any other backend
+    qualifies, and backends whose circuit breaker is open get no traffic.
+    If the chosen backend hasn't answered by its p95 latency, the request
+    is hedged to the next-best backend and the first success wins.
+    """
+
+    def __init__(
+        self,
+        backends: Dict[str, Callable[[Any], Awaitable[Any]]],
+        stats: Dict[str, BackendStats],
+        fallback: str,
+        min_quality: float = 0.0,
+        hedge_default_ms: float = 3000.0,
+        hedging: bool = True,
+    ):
+        self.backends = backends
+        self.stats = stats
+        self.fallback = fallback
+        self.min_quality = min_quality
+        self.hedge_default_ms = hedge_default_ms
+        self.hedging = hedging
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.requests = 0
+
+    def rank(self, peek: bool = False) -> List[str]:
+        """Backends allowed to take traffic, best expected latency first
+
+        With `peek`, breakers are only inspected (for stats), not advanced.
+        """
+        allowed = [
+            name for name, stats in self.stats.items()
+            if (stats.breaker.would_allow() if peek else stats.breaker.allow())
+        ]
+        if not allowed:
+            # Everything is tripped; the local fallback still has to answer
+            return [self.fallback]
+        qualified = [name for name in allowed if self.stats[name].quality() >= self.min_quality]
+        candidates = qualified or allowed
+        return sorted(candidates, key=lambda name: self.stats[name].expected_latency())
+
+    async def extract(self, image_source) -> Any:
+        self.requests += 1
+        ranked = self.rank()
+        primary = ranked[0]
+        secondary = ranked[1] if len(ranked) > 1 else None
+
+        tasks = {asyncio.ensure_future(self._call(primary, image_source)): primary}
+        try:
+            if self.hedging and secondary is not None:
+                done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(primary))
+                if not done:
+                    self.hedges += 1
+                    print(f"[OCRRouter] {primary} past hedge deadline, hedging to {secondary}")
+                    tasks[asyncio.ensure_future(self._call(secondary, image_source))] = secondary
+
+            last_error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] != primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+
+            # Every attempt failed: try remaining backends in rank order
+            tried = set(tasks.values())
+            for name in ranked + [self.fallback]:
+                if name in tried:
+                    continue
+                tried.add(name)
+                try:
+                    return await self._call(name, image_source)
+                except Exception as e:
+                    last_error = e
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    # Losing hedge; a Tesseract thread finishes in the
+                    # background but its result is discarded
+                    task.cancel()
+
+    async def _call(self, name: str, image_source) -> Any:
+        stats = self.stats[name]
+        stats.in_flight += 1
+        stats.breaker.on_start()
+        started = time.perf_counter()
+        try:
+            result = await self.backends[name](image_source)
+        except asyncio.CancelledError:
+            # Lost a hedge: still evidence of how slow this backend is
+            stats.record_censored((time.perf_counter() - started) * 1000)
+            stats.breaker.on_cancel()
+            raise
+        except Exception as e:
+            stats.record((time.perf_counter() - started) * 1000, success=False)
+            print(f"[OCRRouter] {name} failed: {type(e).__name__}: {e}")
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.record(
+            (time.perf_counter() - started) * 1000,
+            success=True,
+            confidence=getattr(result, "confidence", None),
+        )
+        return result
+
+    def _hedge_delay(self, name: str) -> float:
+        p95 = self.stats[name].p95()
+        return max(0.1, (p95 if p95 is not None else self.hedge_default_ms) / 1000.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedgeRate": round(self.hedges / self.requests, 3) if self.requests else 0.0,
+            "hedgeWins": self.hedge_wins,
+            "minQuality": self.min_quality,
+            "ranking": self.rank(peek=True),
+            "backends": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
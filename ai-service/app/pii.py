@@ -1,8 +1,11 @@
-from presidio_analyzer import AnalyzerEngine
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
 from presidio_anonymizer import AnonymizerEngine
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+import os
 import re
 
+import phonenumbers
+
 
 class PIIEntity:
     def __init__(self, type: str, value: str, confidence: float, start: int, end: int):
@@ -19,46 +22,185 @@ class PIIResult:
         self.blurred_regions = blurred_regions
 
 
+# Entity types handled by the compiled-regex tier
+PATTERN_ENTITIES = ["EMAIL_ADDRESS", "PHONE_NUMBER", "CREDIT_CARD", "SSN", "IP_ADDRESS"]
+# Entity types that need spaCy NER through Presidio
+NLP_ENTITIES = ["PERSON", "LOCATION", "DATE_TIME"]
+DEFAULT_ENTITIES = PATTERN_ENTITIES + NLP_ENTITIES
+
+PII_MODES = ("fast", "full")
+
+EMAIL_PATTERN = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
+PHONE_PATTERN = re.compile(
+    r"(?<![\w+])(?:\+?\d{1,3}[\s.-]?)?(?:\(\d{2,4}\)|\d{2,4})[\s.-]?\d{3,4}[\s.-]?\d{3,4}(?!\w)"
+)
+CREDIT_CARD_PATTERN = re.compile(r"(?<!\d)(?:\d[ -]?){12,18}\d(?!\d)")
+SSN_PATTERN = re.compile(r"(?<!\d)(\d{3})([- ])(\d{2})\2(\d{4})(?!\d)")
+IP_PATTERN = re.compile(r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])")
+
+# Cheap gates for the NLP tier. Names and places show up as runs of
+# Title-case words; single capitalized words are mostly UI labels.
+TITLE_RUN_PATTERN = re.compile(r"\b[A-Z][a-z]+(?: [A-Z][a-z]+)+\b")
+# Headers and form values are often ALL CAPS (JOHN SMITH, SAN FRANCISCO)
+UPPER_RUN_PATTERN = re.compile(r"\b[A-Z]{2,}(?: [A-Z]{2,})+\b")
+UI_WORDS = {
+    "Account", "Add", "All", "Back", "Cancel", "Cart", "Checkout", "Close", "Continue",
+    "Create", "Dashboard", "Delete", "Details", "Done", "Download", "Edit", "Export",
+    "File", "Filter", "Help", "History", "Home", "Import", "Log", "Login", "Logout",
+    "Menu", "More", "Next", "Open", "Order", "Orders", "Page", "Previous",
+    "Profile", "Remove", "Reports", "Save", "Search", "Select", "Send", "Settings",
+    "Share", "Show", "Sign", "Submit", "Update", "Upload", "User", "View", "Welcome",
+}
+MONTH = (
+    r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|"
+    r"Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+)
+MONTH_PATTERN = re.compile(MONTH)
+DATE_SHAPE_PATTERN = re.compile(
+    rf"\b{MONTH}\.? \d{{1,2}}(?:st|nd|rd|th)?\b"     # Mar 5, March 3rd
+    rf"|\b\d{{1,2}}(?:st|nd|rd|th)? (?:of )?{MONTH}\b"  # 5 March, 3rd of March
+    r"|\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b"  # 3/5, 03-05-2024
+    r"|\b\d{4}-\d{2}-\d{2}\b"              # 2024-03-05
+    r"|\b\d{1,2}:\d{2}\b"                   # 14:30
+)
+
+# Texts shorter than this cannot hold any entity we detect
+MIN_TEXT_LENGTH = 3
+
+
+def luhn_valid(number: str) -> bool:
+    """Luhn checksum used by payment card numbers"""
+    digits = [int(d) for d in number if d.isdigit()]
+    if len(digits) < 13 or len(digits) > 19:
+        return False
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2 == 1:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+
+def ssn_valid(area: str, group: str, serial: str) -> bool:
+    """Reject SSNs in ranges the SSA never issues"""
+    if area in ("000", "666") or area.startswith("9"):
+        return False
+    return group != "00" and serial != "0000"
+
+
 class PIIService:
     """PII detection service using Presidio"""
 
     def __init__(self):
+        # Region used to validate phone numbers written without a +country code
+        self.phone_region = os.getenv("PII_PHONE_REGION", "US")
         self.analyzer = AnalyzerEngine()
+        self.batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.analyzer)
         self.anonymizer = AnonymizerEngine()
 
-    async def detect_pii(self, text: str) -> PIIResult:
-        """Detect PII in text and return entities with blur regions"""
-
-        # Analyze text for PII
-        results = self.analyzer.analyze(
-            text=text,
-            language="en",
-            entities=[
-                "EMAIL_ADDRESS",
-                "PHONE_NUMBER",
-                "CREDIT_CARD",
-                "SSN",
-                "IP_ADDRESS",
-                "PERSON",
-                "LOCATION",
-                "DATE_TIME",
-            ],
-        )
+    async def detect_pii(
+        self,
+        text: str,
+        mode: str = "full",
+        entities: Optional[List[str]] = None,
+    ) -> PIIResult:
+        """Detect PII in text and return entities with blur regions
+
+        "fast" mode only runs the compiled-regex tier. "full" mode also runs
+        Presidio NLP for the requested NLP entity types, or, when none are
+        requested explicitly, only if the text looks like it could hold them:
+        two or more adjacent Title-case or ALL-CAPS words that aren't UI
+        vocabulary for PERSON/LOCATION, a date shape for DATE_TIME. Names
+        written in lowercase (usernames, "john smith") and single-word names
+        never pass the gate; pass `entities` explicitly to always run NER.
+        """
+
+        self._check_mode(mode)
+
+        requested = entities or DEFAULT_ENTITIES
+        results = []
+        if self._worth_scanning(text):
+            results = self._detect_patterns(text, requested)
+            if mode == "full":
+                nlp_entities = self._nlp_entities_for(text, requested, explicit=entities is not None)
+                if nlp_entities:
+                    results.extend(self._detect_nlp(text, nlp_entities))
+
+        return self._to_result(text, results)
+
+    def detect_pii_batch(
+        self,
+        texts: List[str],
+        mode: str = "full",
+        entities: Optional[List[str]] = None,
+    ) -> List[PIIResult]:
+        """Detect PII in many texts, running the NLP tier as one spaCy batch
+
+        Blocking; callers on the event loop should run it in a thread.
+        """
+
+        self._check_mode(mode)
+
+        requested = entities or DEFAULT_ENTITIES
+        per_text = []
+        nlp_indexes = []
+        nlp_wanted = []
+        for i, text in enumerate(texts):
+            results = []
+            if self._worth_scanning(text):
+                results = self._detect_patterns(text, requested)
+                if mode == "full":
+                    nlp_entities = self._nlp_entities_for(text, requested, explicit=entities is not None)
+                    if nlp_entities:
+                        nlp_indexes.append(i)
+                        nlp_wanted.append(nlp_entities)
+            per_text.append(results)
+
+        if nlp_indexes:
+            union = sorted({e for wanted in nlp_wanted for e in wanted})
+            # nlp_engine.process_batch runs spaCy's nlp.pipe over all texts
+            batch_results = self.batch_analyzer.analyze_iterator(
+                texts=[texts[i] for i in nlp_indexes],
+                language="en",
+                entities=union,
+            )
+            for i, wanted, results in zip(nlp_indexes, nlp_wanted, batch_results):
+                per_text[i].extend(
+                    (r.entity_type, r.start, r.end, r.score)
+                    for r in results
+                    if r.entity_type in wanted
+                )
+
+        return [self._to_result(text, results) for text, results in zip(texts, per_text)]
+
+    @staticmethod
+    def _check_mode(mode: str):
+        if mode not in PII_MODES:
+            raise ValueError(f"Unknown PII mode '{mode}', expected one of {PII_MODES}")
+
+    @staticmethod
+    def _worth_scanning(text: str) -> bool:
+        return bool(text) and len(text.strip()) >= MIN_TEXT_LENGTH
+
+    def _to_result(self, text: str, results: List[Tuple[str, int, int, float]]) -> PIIResult:
+        results.sort(key=lambda r: r[1])
 
         # Convert to entities list
-        entities = []
-        for result in results:
-            entities.append({
-                "type": result.entity_type,
-                "value": text[result.start:result.end],
-                "confidence": result.score,
-                "start": result.start,
-                "end": result.end,
+        entities_found = []
+        for entity_type, start, end, score in results:
+            entities_found.append({
+                "type": entity_type,
+                "value": text[start:end],
+                "confidence": score,
+                "start": start,
+                "end": end,
             })
 
         # Generate blur regions (simplified - in production, map to image coordinates)
         blurred_regions = []
-        for entity in entities:
+        for entity in entities_found:
             # This is a simplified version
             # In production, you'd need to map text positions to image coordinates
             blurred_regions.append({
@@ -69,7 +211,96 @@ class PIIService:
                 "type": entity["type"],
             })
 
-        return PIIResult(entities, blurred_regions)
+        return PIIResult(entities_found, blurred_regions)
+
+    def _detect_patterns(self, text: str, requested: List[str]) -> List[Tuple[str, int, int, float]]:
+        """Fast tier: compiled regexes with checksum/range validation"""
+
+        results = []
+        if "EMAIL_ADDRESS" in requested:
+            for match in EMAIL_PATTERN.finditer(text):
+                results.append(("EMAIL_ADDRESS", match.start(), match.end(), 1.0))
+
+        # Long digit runs are claimed by the card tier even when they fail
+        # Luhn, so they don't resurface as phone numbers or SSNs
+        digit_runs = []
+        for match in CREDIT_CARD_PATTERN.finditer(text):
+            digit_runs.append(("", match.start(), match.end(), 0.0))
+            if "CREDIT_CARD" in requested and luhn_valid(match.group()):
+                results.append(("CREDIT_CARD", match.start(), match.end(), 1.0))
+
+        if "IP_ADDRESS" in requested:
+            for match in IP_PATTERN.finditer(text):
+                if all(int(octet) <= 255 for octet in match.group().split(".")):
+                    results.append(("IP_ADDRESS", match.start(), match.end(), 0.95))
+
+        if "SSN" in requested:
+            for match in SSN_PATTERN.finditer(text):
+                # Delimited only: bare 9-digit runs are order numbers and IDs far more often
+                area, _, group, serial = match.groups()
+                if ssn_valid(area, group, serial) and not self._overlaps(digit_runs, match.start(), match.end()):
+                    results.append(("SSN", match.start(), match.end(), 0.85))
+
+        if "PHONE_NUMBER" in requested:
+            for match in PHONE_PATTERN.finditer(text):
+                # Bare digit runs are order numbers and IDs, not phone numbers
+                if match.group().isdigit():
+                    continue
+                claimed = digit_runs + results
+                if self._phone_valid(match.group()) and not self._overlaps(claimed, match.start(), match.end()):
+                    results.append(("PHONE_NUMBER", match.start(), match.end(), 0.75))
+
+        return results
+
+    def _phone_valid(self, candidate: str) -> bool:
+        """Check a regex match is a dialable number, not a ZIP+4, invoice or ID run"""
+        try:
+            number = phonenumbers.parse(candidate, self.phone_region)
+        except phonenumbers.NumberParseException:
+            return False
+        return phonenumbers.is_valid_number(number)
+
+    def _nlp_entities_for(self, text: str, requested: List[str], explicit: bool) -> List[str]:
+        """Pick which NLP entity types are worth running spaCy for"""
+
+        nlp_entities = [e for e in requested if e not in PATTERN_ENTITIES]
+        if explicit:
+            return nlp_entities
+
+        selected = []
+        has_proper_noun = self._has_proper_noun(text)
+        for entity_type in nlp_entities:
+            if entity_type == "DATE_TIME":
+                if DATE_SHAPE_PATTERN.search(text):
+                    selected.append(entity_type)
+            elif has_proper_noun:
+                selected.append(entity_type)
+        return selected
+
+    @staticmethod
+    def _has_proper_noun(text: str) -> bool:
+        """Two or more adjacent Title-case or ALL-CAPS words that aren't UI vocabulary"""
+        runs = [m.group() for m in TITLE_RUN_PATTERN.finditer(text)]
+        runs += [m.group() for m in UPPER_RUN_PATTERN.finditer(text)]
+        for run in runs:
+            words = [w.capitalize() for w in run.split()]
+            names = [w for w in words if w not in UI_WORDS and not MONTH_PATTERN.fullmatch(w)]
+            if len(names) >= 2:
+                return True
+        return False
+
+    def _detect_nlp(self, text: str, entities: List[str]) -> List[Tuple[str, int, int, float]]:
+        """Slow tier: Presidio analyzer restricted to NLP entity types"""
+
+        results = self.analyzer.analyze(text=text, language="en", entities=entities)
+        return [
+            (result.entity_type, result.start, result.end, result.score)
+            for result in results
+        ]
+
+    @staticmethod
+    def _overlaps(results: List[Tuple[str, int, int, float]], start: int, end: int) -> bool:
+        return any(start < r_end and r_start < end for _, r_start, r_end, _ in results)
 
     async def anonymize_text(self, text: str) -> str:
         """Anonymize PII in text"""
@@ -1,16 +1,104 @@
 from PIL import Image, ImageFilter
 import io
-import numpy as np
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional
 
+from app.image_input import ImageSource, open_image
+from app.ingestion import run_in_thread
 
-async def apply_blur(image_bytes: bytes, blurred_regions: List[Dict]) -> bytes:
-    """Apply blur to specified regions in image"""
 
-    # Open image
-    image = Image.open(io.BytesIO(image_bytes))
-    image_array = np.array(image)
+OUTPUT_FORMATS = ("png", "png_optimized", "png_quantized", "webp", "webp_lossless")
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "png_optimized": "image/png",
+    "png_quantized": "image/png",
+    "webp": "image/webp",
+    "webp_lossless": "image/webp",
+}
+
+
+class ImageEncoding:
+    """How a redacted image (and its preview thumbnails) is encoded"""
+
+    def __init__(
+        self,
+        format: str = "png",
+        quality: int = 80,
+        thumbnail_widths: Optional[List[int]] = None,
+        thumbnail_format: str = "webp",
+    ):
+        for name in (format, thumbnail_format):
+            if name not in OUTPUT_FORMATS:
+                raise ValueError(f"Unknown output format '{name}', expected one of {OUTPUT_FORMATS}")
+        self.format = format
+        # Lossy WebP quality, or compression effort for lossless WebP
+        self.quality = max(0, min(100, quality))
+        self.thumbnail_widths = thumbnail_widths or []
+        self.thumbnail_format = thumbnail_format
+
+
+class EncodedImage:
+    def __init__(self, data: bytes, format: str, width: int, height: int, encode_ms: float):
+        self.data = data
+        self.format = format
+        self.media_type = MEDIA_TYPES[format]
+        self.extension = "webp" if format.startswith("webp") else "png"
+        self.width = width
+        self.height = height
+        self.encode_ms = encode_ms
+
+    def describe(self) -> Dict:
+        return {
+            "format": self.format,
+            "mediaType": self.media_type,
+            "width": self.width,
+            "height": self.height,
+            "bytes": len(self.data),
+            "encodeMs": self.encode_ms,
+        }
+
+
+class RedactedImage:
+    def __init__(self, image: EncodedImage, thumbnails: List[EncodedImage]):
+        self.image = image
+        self.thumbnails = thumbnails
+
+
+def encode_image(image: Image.Image, format: str, quality: int = 80) -> EncodedImage:
+    """Encode an image, trading CPU for bytes according to `format`
 
+    - png: PIL defaults (fast, largest)
+    - png_optimized: zlib level 9 with optimize (lossless, slower)
+    - png_quantized: 256-colour palette, then optimized (small, near-lossless
+      for UI screenshots)
+    - webp: lossy WebP at `quality`
+    - webp_lossless: lossless WebP, `quality` sets compression effort
+    """
+
+    started = time.perf_counter()
+    output = io.BytesIO()
+
+    if format == "png":
+        image.save(output, format="PNG")
+    elif format == "png_optimized":
+        image.save(output, format="PNG", optimize=True, compress_level=9)
+    elif format == "png_quantized":
+        source = image if image.mode in ("RGB", "RGBA") else image.convert("RGBA")
+        quantized = source.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        quantized.save(output, format="PNG", optimize=True)
+    elif format == "webp":
+        image.save(output, format="WEBP", quality=quality, method=4)
+    elif format == "webp_lossless":
+        image.save(output, format="WEBP", lossless=True, quality=quality, method=4)
+    else:
+        raise ValueError(f"Unknown output format '{format}'")
+
+    encode_ms = round((time.perf_counter() - started) * 1000, 1)
+    return EncodedImage(output.getvalue(), format, image.width, image.height, encode_ms)
+
+
+def _blur_regions(image: Image.Image, blurred_regions: List[Dict]) -> Image.Image:
     # Apply blur to each region
     for region in blurred_regions:
         x = int(region.get("x", 0))
@@ -34,11 +122,33 @@ async def apply_blur(image_bytes: bytes, blurred_regions: List[Dict]) -> bytes:
             # Paste back
             image.paste(blurred_region, (x, y))
 
+    return image
+
+
+def _redact(image_source: ImageSource, blurred_regions: List[Dict], encoding: ImageEncoding) -> RedactedImage:
+    # Open image
+    image = _blur_regions(open_image(image_source), blurred_regions)
+
     # Convert back to bytes
-    output = io.BytesIO()
-    image.save(output, format="PNG")
-    return output.getvalue()
+    encoded = encode_image(image, encoding.format, encoding.quality)
+
+    # Thumbnails come from the already decoded, blurred frame
+    thumbnails = []
+    for width in sorted(set(encoding.thumbnail_widths), reverse=True):
+        if width <= 0 or width >= image.width:
+            continue
+        height = max(1, round(image.height * width / float(image.width)))
+        thumbnail = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        thumbnails.append(encode_image(thumbnail, encoding.thumbnail_format, encoding.quality))
 
+    return RedactedImage(encoded, thumbnails)
 
 
+async def apply_blur(
+    image_source: ImageSource,
+    blurred_regions: List[Dict],
+    encoding: Optional[ImageEncoding] = None,
+) -> RedactedImage:
+    """Apply blur to specified regions in image and encode the result"""
 
+    return await run_in_thread(_redact, image_source, blurred_regions, encoding or ImageEncoding())
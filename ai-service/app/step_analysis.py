@@ -0,0 +1,169 @@
+import asyncio
+import time
+from typing import List, Dict, Optional, Callable, Awaitable
+
+from app.image_input import ImageSource, open_image
+from app.ingestion import run_in_thread
+from app.ocr import OCRService
+from app.pii import PIIService
+from app.embeddings import EmbeddingService
+from app.llm_hedging import within_deadline, DEADLINE_MARGIN
+
+
+STAGES = ("ocr", "pii", "enhance", "embedding")
+# Stages that need the screenshot
+IMAGE_STAGES = ("ocr", "pii")
+
+
+class StepAnalyzer:
+    """Runs all per-step AI work from a single request.
+
+    The screenshot is decoded once, and only when Tesseract will read it.
+    OCR and description enhancement start together; PII waits on the OCR
+    text and the embedding waits on the enhanced description (when both are
+    requested), so each stage starts as soon as its input exists. A failing stage is reported
+    in `errors` without failing the others; so is a stage still running
+    when the request deadline is about to pass.
+    """
+
+    def __init__(
+        self,
+        ocr_service: Optional[OCRService],
+        pii_service: Optional[PIIService],
+        embedding_service: Optional[EmbeddingService],
+        enhance: Optional[Callable[[str, dict], Awaitable[str]]],
+    ):
+        self.ocr_service = ocr_service
+        self.pii_service = pii_service
+        self.embedding_service = embedding_service
+        self.enhance = enhance
+
+    @staticmethod
+    def resolve_stages(stages: Optional[List[str]], has_image: bool) -> List[str]:
+        """Validate requested stages; default to everything applicable"""
+        if not stages:
+            stages = [s for s in STAGES if has_image or s not in IMAGE_STAGES]
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown}, expected some of {list(STAGES)}")
+        selected = set(stages)
+        if "pii" in selected:
+            # PII runs on OCR text
+            selected.add("ocr")
+        if not has_image and selected & set(IMAGE_STAGES):
+            raise ValueError("OCR and PII stages need a screenshot")
+        return [s for s in STAGES if s in selected]
+
+    async def analyze(
+        self,
+        stages: List[str],
+        image_source: Optional[ImageSource] = None,
+        description: str = "",
+        context: Optional[dict] = None,
+        dom_event: Optional[dict] = None,
+        pii_mode: str = "full",
+        pii_entities: Optional[List[str]] = None,
+    ) -> Dict:
+        started = time.perf_counter()
+        context = context or {}
+        timings: Dict[str, float] = {}
+        errors: Dict[str, str] = {}
+        result: Dict = {"stages": stages}
+
+        image = None
+        if image_source is not None and set(stages) & set(IMAGE_STAGES):
+            if self.ocr_service is not None and not self.ocr_service.use_google_vision:
+                stage_started = time.perf_counter()
+                image = await within_deadline(
+                    run_in_thread(self._decode, image_source), "decode", DEADLINE_MARGIN
+                )
+                timings["decode"] = self._elapsed_ms(stage_started)
+                size = image.size
+            else:
+                # Vision re-reads the encoded source; only the header is parsed
+                size = open_image(image_source).size
+            result["image"] = {"width": size[0], "height": size[1]}
+
+        async def timed(name: str, coro):
+            stage_started = time.perf_counter()
+            try:
+                return await within_deadline(coro, name, DEADLINE_MARGIN)
+            except Exception as e:
+                print(f"[StepAnalysis] {name} failed: {type(e).__name__}: {e}")
+                errors[name] = str(e)
+                return None
+            finally:
+                timings[name] = self._elapsed_ms(stage_started)
+
+        async def ocr_and_pii():
+            if self.ocr_service is None:
+                errors["ocr"] = "OCR service not initialized"
+                return
+            # Vision wants encoded bytes; Tesseract reuses the decoded frame
+            ocr_input = image if image is not None else image_source
+            ocr_result = await timed("ocr", self.ocr_service.extract_text(ocr_input))
+            if ocr_result is None:
+                return
+            result["ocr"] = {
+                "text": ocr_result.text,
+                "confidence": ocr_result.confidence,
+                "regions": ocr_result.regions,
+            }
+            if "pii" not in stages:
+                return
+            if self.pii_service is None:
+                errors["pii"] = "PII service not initialized"
+                return
+            pii_result = await timed(
+                "pii",
+                asyncio.to_thread(
+                    lambda: self.pii_service.detect_pii_batch([ocr_result.text], pii_mode, pii_entities)[0]
+                ),
+            )
+            if pii_result is not None:
+                result["pii"] = {
+                    "entities": pii_result.entities,
+                    "blurredRegions": pii_result.blurred_regions,
+                }
+
+        async def enhance_and_embed():
+            final_description = description
+            if "enhance" in stages:
+                if self.enhance is None:
+                    errors["enhance"] = "AI service not initialized"
+                else:
+                    enhanced = await timed("enhance", self.enhance(description, context))
+                    if enhanced:
+                        final_description = enhanced
+                        result["enhancedDescription"] = enhanced
+            if "embedding" in stages:
+                if self.embedding_service is None:
+                    errors["embedding"] = "Embedding service not initialized"
+                    return
+                step = {"description": final_description, "domEvent": dom_event or {}}
+                embedding = await timed("embedding", self.embedding_service.generate_step_embedding(step))
+                if embedding is not None:
+                    result["embedding"] = list(embedding)
+
+        work = []
+        if "ocr" in stages:
+            work.append(ocr_and_pii())
+        if "enhance" in stages or "embedding" in stages:
+            work.append(enhance_and_embed())
+        await asyncio.gather(*work)
+
+        timings["total"] = self._elapsed_ms(started)
+        result["timings"] = timings
+        result["errors"] = errors
+        return result
+
+    @staticmethod
+    def _decode(image_source: ImageSource):
+        image = open_image(image_source)
+        # Force the pixel decode now rather than lazily inside a later stage
+        image.load()
+        return image
+
+    @staticmethod
+    def _elapsed_ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
@@ -0,0 +1,88 @@
+import math
+from typing import Dict, List, Optional, Any
+
+
+# Description StepProcessor gives dom_change events
+DOM_CHANGE_DESCRIPTION = "Page content changed"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token for English prose)"""
+    return int(math.ceil(len(text) / 4.0))
+
+
+def _event(step: Dict) -> Dict:
+    event = step.get("domEvent")
+    return event if isinstance(event, dict) else {}
+
+
+def _event_type(step: Dict) -> Optional[str]:
+    return _event(step).get("type")
+
+
+def _field_key(step: Dict) -> Optional[str]:
+    """Identify the input field a step typed into"""
+    target = _event(step).get("target")
+    if not isinstance(target, dict):
+        return None
+    for key in ("selector", "id", "name"):
+        if target.get(key):
+            return f"{key}:{target[key]}"
+    return None
+
+
+class CompactionResult:
+    def __init__(self, steps: List[Dict], mapping: List[List[int]], original_count: int):
+        self.steps = steps
+        # mapping[i] lists the original step indices merged into steps[i]
+        self.mapping = mapping
+        self.original_count = original_count
+        self.dropped = sorted(
+            set(range(original_count)) - {index for indices in mapping for index in indices}
+        )
+
+    def describe(self, tokens_before: Optional[int] = None, tokens_after: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "originalSteps": self.original_count,
+            "compactedSteps": len(self.steps),
+            "mapping": self.mapping,
+            "dropped": self.dropped,
+            "estimatedTokens": {"before": tokens_before, "after": tokens_after},
+        }
+
+
+def compact_steps(steps: List[Dict]) -> CompactionResult:
+    """Reduce recorded steps to the meaningful actions before composing
+
+    - Consecutive inputs into the same field become one step (the last
+      one, which holds the final value).
+    - dom_change steps are folded into the action that caused them; ones
+      with nothing before them are dropped.
+    - Runs of navigations (redirect chains, reloads) collapse to the last
+      destination.
+    """
+
+    compacted: List[Dict] = []
+    mapping: List[List[int]] = []
+
+    for index, step in enumerate(steps):
+        event_type = _event_type(step)
+        previous = compacted[-1] if compacted else None
+        previous_type = _event_type(previous) if previous is not None else None
+
+        if event_type == "dom_change":
+            if previous is not None:
+                mapping[-1].append(index)
+            continue
+
+        if previous is not None and event_type == previous_type:
+            same_field = event_type == "input" and _field_key(step) is not None and _field_key(step) == _field_key(previous)
+            if same_field or event_type == "navigation":
+                compacted[-1] = step
+                mapping[-1].append(index)
+                continue
+
+        compacted.append(step)
+        mapping.append([index])
+
+    return CompactionResult(compacted, mapping, len(steps))
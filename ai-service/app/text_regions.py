@@ -0,0 +1,171 @@
+from typing import List, Dict, Tuple
+import numpy as np
+import cv2
+
+
+# Whitespace around each crop when stacked into an OCR batch image
+BATCH_PADDING = 10
+
+
+class TextRegionDetector:
+    """Fast morphological text-region detector for UI screenshots.
+
+    Proposes bounding boxes that are likely to contain text so OCR can skip
+    whitespace, photos and icons. Detection runs on a downscaled grayscale
+    copy of the frame and boxes are scaled back to source coordinates.
+    """
+
+    def __init__(
+        self,
+        max_side: int = 1600,
+        min_height: int = 6,
+        max_height: int = 120,
+        min_width: int = 8,
+        min_fill: float = 0.15,
+        padding: int = 4,
+    ):
+        self.max_side = max_side
+        self.min_height = min_height
+        self.max_height = max_height
+        self.min_width = min_width
+        self.min_fill = min_fill
+        self.padding = padding
+
+    def detect(self, gray: np.ndarray) -> List[Dict]:
+        """Return text regions as {x, y, width, height} dicts in reading order"""
+
+        height, width = gray.shape[:2]
+        if height == 0 or width == 0:
+            return []
+
+        scale = min(1.0, self.max_side / float(max(height, width)))
+        small = gray
+        if scale < 1.0:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        # Text has dense, high-contrast edges: take the morphological gradient,
+        # binarize it and smear horizontally so characters join into lines.
+        gradient = cv2.morphologyEx(
+            small,
+            cv2.MORPH_GRADIENT,
+            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
+        )
+        _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+        # Borders of cards, modals, tables and inputs are long straight runs;
+        # take them out so they don't fuse the text they enclose into one blob
+        line_length = max(15, int(60 * scale))
+        borders = cv2.bitwise_or(
+            cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (line_length, 1))),
+            cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, line_length))),
+        )
+        binary = cv2.subtract(binary, borders)
+
+        connected = cv2.morphologyEx(
+            binary,
+            cv2.MORPH_CLOSE,
+            cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)),
+        )
+        # RETR_LIST, not RETR_EXTERNAL: a dropped oversized contour must not
+        # hide the text lines nested inside it
+        contours, _ = cv2.findContours(connected, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            # Scale size thresholds with the detection resolution
+            if h < self.min_height * scale or w < self.min_width * scale:
+                continue
+            if h > self.max_height * scale:
+                # Tall blobs are photos, charts or large graphics; any text
+                # inside has contours of its own
+                continue
+            fill = cv2.countNonZero(binary[y:y + h, x:x + w]) / float(w * h)
+            if fill < self.min_fill:
+                continue
+            if w < h * 1.2 and fill > 0.6:
+                # Small solid squares are icons/bullets rather than words
+                continue
+            boxes.append(self._to_source(x, y, w, h, scale, width, height))
+
+        merged = self._merge(boxes)
+        merged.sort(key=lambda b: (b[1], b[0]))
+        return [
+            {"x": x, "y": y, "width": w, "height": h}
+            for x, y, w, h in merged
+        ]
+
+    def _to_source(
+        self, x: int, y: int, w: int, h: int, scale: float, width: int, height: int
+    ) -> Tuple[int, int, int, int]:
+        pad = self.padding
+        x0 = max(0, int(x / scale) - pad)
+        y0 = max(0, int(y / scale) - pad)
+        x1 = min(width, int((x + w) / scale) + pad)
+        y1 = min(height, int((y + h) / scale) + pad)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _merge(self, boxes: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+        """Merge overlapping boxes so a line is not OCR'd twice"""
+
+        merged = list(boxes)
+        changed = True
+        while changed:
+            changed = False
+            result = []
+            while merged:
+                x, y, w, h = merged.pop()
+                i = 0
+                while i < len(merged):
+                    ox, oy, ow, oh = merged[i]
+                    if x <= ox + ow and ox <= x + w and y <= oy + oh and oy <= y + h:
+                        nx, ny = min(x, ox), min(y, oy)
+                        w = max(x + w, ox + ow) - nx
+                        h = max(y + h, oy + oh) - ny
+                        x, y = nx, ny
+                        merged.pop(i)
+                        changed = True
+                    else:
+                        i += 1
+                result.append((x, y, w, h))
+            merged = result
+        return merged
+
+
+def build_batches(
+    gray: np.ndarray,
+    regions: List[Dict],
+    padding: int = BATCH_PADDING,
+    max_height: int = 8000,
+) -> List[Tuple[np.ndarray, List[Tuple[int, Dict]]]]:
+    """Stack region crops vertically into OCR batch images.
+
+    Each batch is returned with a list of (strip_top, region) pairs so that
+    word boxes found in the batch can be mapped back to the source image.
+    """
+
+    batches = []
+    current: List[Tuple[int, Dict]] = []
+    current_height = padding
+
+    def flush():
+        if not current:
+            return
+        canvas_width = max(r["width"] for _, r in current) + 2 * padding
+        canvas = np.full((current_height, canvas_width), 255, dtype=np.uint8)
+        for top, region in current:
+            x, y, w, h = region["x"], region["y"], region["width"], region["height"]
+            canvas[top:top + h, padding:padding + w] = gray[y:y + h, x:x + w]
+        batches.append((canvas, list(current)))
+
+    for region in regions:
+        needed = region["height"] + padding
+        if current and current_height + needed > max_height:
+            flush()
+            current = []
+            current_height = padding
+        current.append((current_height, region))
+        current_height += needed
+
+    flush()
+    return batches
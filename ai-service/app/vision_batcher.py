@@ -0,0 +1,155 @@
+import asyncio
+import os
+from typing import List, Dict, Optional, Tuple
+
+from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports import (
+    ImageAnnotatorGrpcAsyncIOTransport,
+)
+
+
+class VisionItemError(Exception):
+    """Vision returned an error for one image of a batch"""
+
+
+class VisionBatcher:
+    """Micro-batches concurrent Google Vision requests.
+
+    Images submitted within `window_ms` of each other (up to `max_batch`
+    images or `max_batch_bytes` of content) are sent as one async
+    `batch_annotate_images` RPC. Errors are reported per image so callers
+    can fall back for just the images that failed.
+
+    Set GOOGLE_VISION_ENDPOINT (e.g. "localhost:9090") to talk to a local
+    fake Vision server over an insecure channel without credentials.
+    """
+
+    def __init__(
+        self,
+        window_ms: float = 20,
+        max_batch: int = 16,
+        max_batch_bytes: int = 8 * 1024 * 1024,
+        endpoint: Optional[str] = None,
+        client=None,
+    ):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.endpoint = endpoint if endpoint is not None else os.getenv("GOOGLE_VISION_ENDPOINT")
+        self._client = client
+        self._pending: List[Tuple[bytes, asyncio.Future]] = []
+        self._pending_bytes = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+
+    async def annotate(self, content: bytes) -> Dict:
+        """Return {"text", "confidence", "words"} for one image"""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if self._pending and self._pending_bytes + len(content) > self.max_batch_bytes:
+            self._flush()
+        self._pending.append((content, future))
+        self._pending_bytes += len(content)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        self._pending_bytes = 0
+
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[bytes, asyncio.Future]]):
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+            )
+            for content, _ in batch
+        ]
+
+        try:
+            response = await self._get_client().batch_annotate_images(requests=requests)
+        except Exception as e:
+            print(f"[OCR] Vision batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), item in zip(batch, response.responses):
+            if future.done():
+                # Caller gave up (cancelled) while the batch was in flight
+                continue
+            if item.error and item.error.message:
+                future.set_exception(VisionItemError(item.error.message))
+            else:
+                future.set_result(self._parse(item))
+
+        # A short response must not leave callers waiting forever
+        for _, future in batch[len(response.responses):]:
+            if not future.done():
+                future.set_exception(VisionItemError("No response for image in batch"))
+
+    def _get_client(self):
+        # Created lazily so the gRPC channel binds to the running event loop
+        if self._client is None:
+            if self.endpoint:
+                import grpc
+                from google.auth.credentials import AnonymousCredentials
+
+                transport = ImageAnnotatorGrpcAsyncIOTransport(
+                    channel=grpc.aio.insecure_channel(self.endpoint),
+                    credentials=AnonymousCredentials(),
+                )
+                self._client = vision.ImageAnnotatorAsyncClient(transport=transport)
+            else:
+                self._client = vision.ImageAnnotatorAsyncClient()
+        return self._client
+
+    @staticmethod
+    def _parse(item) -> Dict:
+        words = []
+        confidences = []
+        annotation = item.full_text_annotation
+        for page in annotation.pages:
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        xs = [v.x for v in word.bounding_box.vertices]
+                        ys = [v.y for v in word.bounding_box.vertices]
+                        words.append({
+                            "text": "".join(symbol.text for symbol in word.symbols),
+                            "confidence": word.confidence,
+                            "x": min(xs) if xs else 0,
+                            "y": min(ys) if ys else 0,
+                            "width": (max(xs) - min(xs)) if xs else 0,
+                            "height": (max(ys) - min(ys)) if ys else 0,
+                        })
+                        if word.confidence > 0:
+                            confidences.append(word.confidence)
+
+        text = annotation.text
+        if not text and item.text_annotations:
+            text = item.text_annotations[0].description
+
+        if not text:
+            return {"text": "", "confidence": 0.0, "words": []}
+
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.9
+        return {"text": text.strip(), "confidence": avg_confidence, "words": words}
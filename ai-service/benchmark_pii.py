@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark fast vs full PII detection on typical OCR texts"""
+import asyncio
+import sys
+import time
+
+from app.pii import PIIService, DEFAULT_ENTITIES
+
+SAMPLES = [
+    "",
+    "OK",
+    "Search  Sign in  Cart (0)",
+    "Settings > Account > Billing  Save changes  Cancel",
+    "Contact us at support@example.com or call +1 415-555-0132",
+    "Card number 4111 1111 1111 1111  Expires 04/27  CVV",
+    "Welcome back, Jane Smith! Your order to Berlin ships on March 3rd.",
+    "Server 10.0.0.12 responded in 120ms  SSN on file: 123-45-6789",
+]
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+async def run(service: PIIService, mode: str) -> float:
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for text in SAMPLES:
+            await service.detect_pii(text, mode=mode)
+    return (time.perf_counter() - started) * 1000 / (ITERATIONS * len(SAMPLES))
+
+
+def run_presidio_only(service: PIIService) -> float:
+    """Previous behaviour: full Presidio analyzer on every text"""
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for text in SAMPLES:
+            service.analyzer.analyze(text=text, language="en", entities=DEFAULT_ENTITIES)
+    return (time.perf_counter() - started) * 1000 / (ITERATIONS * len(SAMPLES))
+
+
+async def main():
+    print("Loading Presidio analyzer...")
+    service = PIIService()
+
+    # Warm up spaCy so model loading isn't counted
+    await service.detect_pii(SAMPLES[-2], mode="full")
+
+    for text in SAMPLES:
+        fast = await service.detect_pii(text, mode="fast")
+        full = await service.detect_pii(text, mode="full")
+        print(f"\n{text!r}")
+        print(f"  fast: {[e['type'] for e in fast.entities]}")
+        print(f"  full: {[e['type'] for e in full.entities]}")
+
+    fast_ms = await run(service, "fast")
+    full_ms = await run(service, "full")
+    presidio_ms = run_presidio_only(service)
+
+    print(f"\nIterations: {ITERATIONS} x {len(SAMPLES)} texts")
+    print(f"fast: {fast_ms:.3f} ms/text")
+    print(f"full: {full_ms:.3f} ms/text")
+    print(f"presidio only: {presidio_ms:.3f} ms/text")
+    if fast_ms > 0 and full_ms > 0:
+        print(f"speed-up fast vs presidio: {presidio_ms / fast_ms:.1f}x")
+        print(f"speed-up full vs presidio: {presidio_ms / full_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Check the text-region detector finds text inside bordered containers
+
+Usage:
+    python check_text_regions.py
+
+Draws a 1280x800 UI frame: a header line, a bordered card holding three
+lines of PII, and a bordered input box. Every line must fall inside a
+detected region, or the region-only OCR path would never see it.
+"""
+import cv2
+import numpy as np
+
+from app.text_regions import TextRegionDetector
+
+
+def draw_frame():
+    frame = np.full((800, 1280), 255, dtype=np.uint8)
+    lines = []
+
+    def text(label, x, y):
+        cv2.putText(frame, label, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2, cv2.LINE_AA)
+        (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+        lines.append((label, x, y - h, w, h))
+
+    text("Account settings", 40, 60)
+
+    # Card: a closed border around several lines of text
+    cv2.rectangle(frame, (40, 120), (760, 420), 0, 2)
+    text("Name: Jane Smith", 80, 190)
+    text("Email: jane@example.com", 80, 260)
+    text("SSN: 123-45-6789", 80, 330)
+
+    # Input box
+    cv2.rectangle(frame, (40, 480), (500, 530), 0, 1)
+    text("Search", 55, 515)
+    return frame, lines
+
+
+def covered(line, regions):
+    _, x, y, w, h = line
+    cx, cy = x + w // 2, y + h // 2
+    return any(
+        r["x"] <= cx <= r["x"] + r["width"] and r["y"] <= cy <= r["y"] + r["height"]
+        for r in regions
+    )
+
+
+def main():
+    frame, lines = draw_frame()
+    regions = TextRegionDetector().detect(frame)
+    print(f"{len(regions)} regions: {regions}")
+    missing = [line[0] for line in lines if not covered(line, regions)]
+    assert not missing, f"text with no region: {missing}"
+    area = sum(r["width"] * r["height"] for r in regions) / float(frame.size)
+    assert area < 0.6, f"regions cover {area:.0%} of the frame; the card was kept whole"
+    print("✅ Text inside bordered containers is detected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Check Vision micro-batching and per-image Tesseract fallback against the fake server
+
+Usage:
+    python check_vision_batching.py [port]
+
+Starts fake_vision_server.py with every 3rd image failing, then:
+1. sends 6 concurrent images through VisionBatcher and checks they went
+   out as one batch, with images 3 and 6 failing individually
+2. runs the same through OCRService (router off) and checks only the
+   failed images fell back to Tesseract
+3. checks a batch response shorter than the request fails the leftover
+   images instead of leaving them waiting
+"""
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import time
+
+from PIL import Image
+
+PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 9091
+ENDPOINT = f"localhost:{PORT}"
+
+os.environ["GOOGLE_VISION_ENDPOINT"] = ENDPOINT
+os.environ["VISION_BATCH_WINDOW_MS"] = "200"
+os.environ["OCR_ROUTER"] = "false"
+
+from app.vision_batcher import VisionBatcher, VisionItemError  # noqa: E402
+from app.ocr import OCRService  # noqa: E402
+
+
+def blank_png(width: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, 40), "white").save(output, format="PNG")
+    return output.getvalue()
+
+
+async def check_batching():
+    batcher = VisionBatcher(window_ms=200, endpoint=ENDPOINT)
+    results = await asyncio.gather(
+        *[batcher.annotate(blank_png(100 + i)) for i in range(6)],
+        return_exceptions=True,
+    )
+    failed = [i for i, r in enumerate(results) if isinstance(r, VisionItemError)]
+    # The fake server numbers images by their position in the batch
+    positions = sorted(int(r["text"].split()[1][len("image"):]) for r in results if isinstance(r, dict))
+    assert failed == [2, 5], f"expected images 3 and 6 to fail, got {failed}"
+    assert positions == [0, 1, 3, 4], f"images were not sent as one batch: {positions}"
+    print("✅ 6 images sent as one batch, 2 per-item errors")
+
+
+async def check_fallback():
+    service = OCRService()
+    assert service.vision_batcher is not None and service.router is None
+    results = await asyncio.gather(*[service.extract_text(blank_png(100 + i)) for i in range(6)])
+    from_vision = [i for i, r in enumerate(results) if r.text.startswith("fake")]
+    assert from_vision == [0, 1, 3, 4], f"unexpected Vision results: {from_vision}"
+    print("✅ Only the failed images fell back to Tesseract")
+
+
+async def check_short_response():
+    class ShortResponse:
+        responses = []
+
+    class ShortClient:
+        async def batch_annotate_images(self, requests):
+            return ShortResponse()
+
+    batcher = VisionBatcher(window_ms=10, client=ShortClient())
+    results = await asyncio.wait_for(
+        asyncio.gather(*[batcher.annotate(b"x") for _ in range(3)], return_exceptions=True),
+        timeout=5,
+    )
+    assert all(isinstance(r, VisionItemError) for r in results), results
+    print("✅ Short batch response fails leftover images")
+
+
+def main():
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), "fake_vision_server.py"), str(PORT), "3"]
+    )
+    try:
+        time.sleep(2)
+        asyncio.run(check_batching())
+        asyncio.run(check_fallback())
+        asyncio.run(check_short_response())
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Local fake Google Vision server for exercising the batched OCR path
+
+Usage:
+    python fake_vision_server.py [port] [fail_every]
+
+Then run the ai-service with GOOGLE_VISION_ENDPOINT=localhost:<port>.
+Every image gets a fixed two-word annotation; with fail_every=N every Nth
+image in a batch returns a per-item error so the Tesseract fallback runs.
+check_vision_batching.py drives it end to end.
+"""
+import sys
+from concurrent import futures
+
+import grpc
+from google.cloud import vision
+
+PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 9090
+FAIL_EVERY = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+METHOD = "/google.cloud.vision.v1.ImageAnnotator/BatchAnnotateImages"
+
+
+def word(text: str, x: int, y: int) -> vision.Word:
+    width = 10 * len(text)
+    return vision.Word(
+        symbols=[vision.Symbol(text=c) for c in text],
+        confidence=0.97,
+        bounding_box=vision.BoundingPoly(vertices=[
+            vision.Vertex(x=x, y=y),
+            vision.Vertex(x=x + width, y=y),
+            vision.Vertex(x=x + width, y=y + 20),
+            vision.Vertex(x=x, y=y + 20),
+        ]),
+    )
+
+
+def batch_annotate_images(request: vision.BatchAnnotateImagesRequest, context):
+    print(f"[FakeVision] Batch of {len(request.requests)} images")
+    responses = []
+    for i, item in enumerate(request.requests):
+        if FAIL_EVERY and (i + 1) % FAIL_EVERY == 0:
+            responses.append(vision.AnnotateImageResponse(
+                error={"code": 3, "message": f"fake failure for image {i}"},
+            ))
+            continue
+        text = f"fake image{i} {len(item.image.content)}bytes"
+        words = [word(w, 10 + 120 * j, 10) for j, w in enumerate(text.split())]
+        responses.append(vision.AnnotateImageResponse(
+            text_annotations=[vision.EntityAnnotation(description=text)],
+            full_text_annotation=vision.TextAnnotation(
+                text=text,
+                pages=[vision.Page(blocks=[vision.Block(paragraphs=[vision.Paragraph(words=words)])])],
+            ),
+        ))
+    return vision.BatchAnnotateImagesResponse(responses=responses)
+
+
+def main():
+    handler = grpc.method_handlers_generic_handler(
+        "google.cloud.vision.v1.ImageAnnotator",
+        {
+            "BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+                batch_annotate_images,
+                request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+                response_serializer=vision.BatchAnnotateImagesResponse.serialize,
+            ),
+        },
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(f"[::]:{PORT}")
+    server.start()
+    print(f"[FakeVision] Listening on localhost:{PORT} ({METHOD})")
+    server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import List, Literal, Optional
 import os
+import json
+import base64
+import asyncio
 
 from app.ocr import OCRService
 from app.pii import PIIService
 from app.composer import DocumentComposer
-from app.embeddings import EmbeddingService
+from app.embeddings import EmbeddingService, GuideEmbedding, GuideEmbeddingStore, step_weight
+from app.batch_redaction import RedactionPipeline
+from app.image_input import read_image_request
+from app.ingestion import ImageBudget, ImageRejected
+from app.step_analysis import StepAnalyzer
+from app.step_compaction import compact_steps
+from app.jobs import JobStore, JobQueue, IdempotencyConflict
+from app.llm_hedging import LLMHedger, DeadlineExceeded, DEADLINE_HEADER, set_deadline, remaining, within_deadline
 
 import google.generativeai as genai
-import httpx
-from app.redaction import apply_blur
+from app.redaction import apply_blur, ImageEncoding
 from urllib.parse import urlparse
 import uvicorn
 
@@ -79,6 +89,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def propagate_deadline(request: Request, call_next):
+    """Bound the whole request by the caller's X-Request-Timeout-Ms budget
+
+    Handlers see the deadline through remaining()/within_deadline and stop
+    individual stages early; this is the backstop for everything else.
+    """
+    timeout_ms = request.headers.get(DEADLINE_HEADER)
+    if timeout_ms is None:
+        return await call_next(request)
+    try:
+        timeout_ms = float(timeout_ms)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": f"Invalid {DEADLINE_HEADER} header"})
+    if timeout_ms <= 0:
+        return JSONResponse(status_code=504, content={"detail": "Deadline already passed"})
+    set_deadline(timeout_ms)
+    try:
+        return await asyncio.wait_for(call_next(request), timeout=max(0.0, remaining()))
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=504, content={"detail": "Deadline exceeded"})
+
+
 # Initialize services (may fail if credentials not available)
 try:
     ocr_service = OCRService()
@@ -101,21 +136,109 @@ except ValueError as e:
     composer = None
     embedding_service = None
 
+# Step enhancement is latency-sensitive: hedge slow Gemini calls
+enhance_hedger = LLMHedger(
+    "enhance",
+    hedging=os.getenv("ENHANCE_HEDGING", "true").lower() == "true",
+    hedge_default_ms=float(os.getenv("ENHANCE_HEDGE_DEFAULT_MS", "4000")),
+    max_hedge_ratio=float(os.getenv("LLM_HEDGE_BUDGET", "0.1")),
+)
+
+# Bounds memory used by images being decoded across all requests
+image_budget = ImageBudget(
+    budget_bytes=int(float(os.getenv("IMAGE_MEMORY_BUDGET_MB", "512")) * 1024 * 1024),
+    max_bytes=int(float(os.getenv("IMAGE_MAX_MB", "25")) * 1024 * 1024),
+    max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", "40000000")),
+    queue_timeout=float(os.getenv("IMAGE_QUEUE_TIMEOUT", "10")),
+)
+
+
+def parse_json_field(value):
+    """Form and query fields arrive as strings; decode JSON (or CSV) lists"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return [v.strip() for v in value.split(",") if v.strip()]
+    return value
+
 
 class RedactionRequest(BaseModel):
+    stepId: str
+    # Optional when the screenshot is uploaded in the request body
+    screenshotUri: Optional[str] = None
+    # "fast" (regex/checksum tier only) or "full" (adds Presidio NLP)
+    piiMode: Optional[Literal["fast", "full"]] = None
+    piiEntities: Optional[List[str]] = None
+
+    @field_validator("piiEntities", mode="before")
+    @classmethod
+    def parse_pii_entities(cls, value):
+        return parse_json_field(value)
+
+
+class BatchRedactionItem(BaseModel):
     stepId: str
     screenshotUri: str
 
 
+class BatchRedactionRequest(BaseModel):
+    guideId: Optional[str] = None
+    steps: List[BatchRedactionItem]
+    piiMode: Optional[Literal["fast", "full"]] = None
+    piiEntities: Optional[List[str]] = None
+
+
 class RedactionApplyRequest(BaseModel):
-    screenshotUri: str
+    screenshotUri: Optional[str] = None
     blurredRegions: List[dict]
+    # png | png_optimized | png_quantized | webp | webp_lossless
+    outputFormat: Optional[str] = None
+    quality: Optional[int] = None
+    thumbnailWidths: Optional[List[int]] = None
+    # For uploaded images: "image" returns the bytes, "json" returns base64
+    # image and thumbnails with encoding stats (always JSON for screenshotUri)
+    responseFormat: Optional[str] = "image"
+
+    @field_validator("blurredRegions", mode="before")
+    @classmethod
+    def parse_blurred_regions(cls, value):
+        return parse_json_field(value)
+
+    @field_validator("thumbnailWidths", mode="before")
+    @classmethod
+    def parse_thumbnail_widths(cls, value):
+        # A single width ("320" or 320) is a one-item list
+        value = parse_json_field(value)
+        if value is not None and not isinstance(value, list):
+            return [value]
+        return value
+
+
+class GuideStepEmbeddingRequest(BaseModel):
+    description: str = ""
+    domEvent: Optional[dict] = None
+    # Pooling weight; defaults by event type
+    weight: Optional[float] = None
+    # A previously returned step vector skips the embedding call
+    embedding: Optional[List[float]] = None
+
+
+class GuideEmbeddingStep(GuideStepEmbeddingRequest):
+    # Stable step id, so later PUT/DELETE calls can target the step
+    id: str
+
+
+class GuideEmbeddingRequest(BaseModel):
+    steps: List[GuideEmbeddingStep]
 
 
 class DocumentRequest(BaseModel):
     guideId: str
     steps: List[dict]
     style: Optional[str] = "professional"
+    # Merge/fold noisy steps before prompting (default COMPOSE_COMPACTION)
+    compact: Optional[bool] = None
 
 
 class StepEnhanceRequest(BaseModel):
@@ -123,11 +246,66 @@ class StepEnhanceRequest(BaseModel):
     context: dict
 
 
+class EmbeddingJobRequest(BaseModel):
+    steps: List[dict]
+
+
+class JobRequest(BaseModel):
+    # "compose", "redaction" or "embedding"
+    kind: str
+    payload: dict
+    # Resubmitting with the same key returns the existing job
+    idempotencyKey: Optional[str] = None
+
+
+class StepAnalyzeRequest(BaseModel):
+    stepId: Optional[str] = None
+    screenshotUri: Optional[str] = None
+    currentDescription: str = ""
+    context: dict = {}
+    domEvent: Optional[dict] = None
+    # Any of "ocr", "pii", "enhance", "embedding"; default is all applicable
+    stages: Optional[List[str]] = None
+    piiMode: Optional[Literal["fast", "full"]] = None
+    piiEntities: Optional[List[str]] = None
+
+    @field_validator("context", "domEvent", "stages", "piiEntities", mode="before")
+    @classmethod
+    def parse_json_fields(cls, value):
+        return parse_json_field(value)
+
+
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
 
 
+@app.get("/ocr/stats")
+async def ocr_stats():
+    """Live OCR backend routing stats (latency, errors, breakers, hedging)"""
+    if ocr_service is None:
+        raise HTTPException(status_code=500, detail="OCR service not initialized")
+    if ocr_service.router is None:
+        backend = "google_vision" if ocr_service.use_google_vision else "tesseract"
+        return {"router": None, "backend": backend}
+    return {"router": ocr_service.router.snapshot()}
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Hedge rate, hedge win rate and deadline misses for Gemini calls"""
+    return {
+        "enhance": enhance_hedger.snapshot(),
+        "compose": composer.hedger.snapshot() if composer is not None else None,
+    }
+
+
+@app.get("/ingest/stats")
+async def ingest_stats():
+    """In-flight image decode memory and admission counters"""
+    return image_budget.snapshot()
+
+
 @app.get("/api/debug/apikey")
 async def debug_apikey():
     """Debug endpoint to check API key status"""
@@ -178,69 +356,193 @@ async def debug_apikey():
 
 
 @app.post("/redaction/process")
-async def process_redaction(request: RedactionRequest):
-    """Process screenshot for OCR and PII detection"""
+async def process_redaction(http_request: Request):
+    """Process screenshot for OCR and PII detection
+
+    Accepts JSON with a screenshotUri, a multipart upload (`screenshot` file
+    plus form fields) or a raw image body with fields in the query string.
+    """
+    fields, image_source = await read_image_request(http_request, max_bytes=image_budget.max_bytes)
+    try:
+        request = RedactionRequest(**fields)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
     try:
         if ocr_service is None or pii_service is None:
             raise HTTPException(status_code=500, detail="OCR or PII service not initialized")
-        
-        # Download image
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(request.screenshotUri)
-            image_bytes = response.content
 
         # Run OCR
-        ocr_result = await ocr_service.extract_text(image_bytes)
-
-        # Detect PII
-        pii_result = await pii_service.detect_pii(ocr_result.text)
+        async with image_budget.admit(image_source) as image_source:
+            ocr_result = await within_deadline(ocr_service.extract_text(image_source), "ocr")
+
+        # Detect PII in a thread: spaCy is blocking, and only a thread lets
+        # the deadline cut the wait without stalling the event loop
+        pii_mode = request.piiMode or os.getenv("PII_MODE", "full")
+        pii_result = await within_deadline(
+            asyncio.to_thread(
+                lambda: pii_service.detect_pii_batch([ocr_result.text], pii_mode, request.piiEntities)[0]
+            ),
+            "pii",
+        )
 
         return {
             "stepId": request.stepId,
             "ocr": {
                 "text": ocr_result.text,
                 "confidence": ocr_result.confidence,
+                "regions": ocr_result.regions,
             },
             "pii": {
                 "entities": pii_result.entities,
                 "blurredRegions": pii_result.blurred_regions,
             },
         }
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/redaction/process/batch")
+async def process_redaction_batch(request: BatchRedactionRequest):
+    """Process all screenshots of a guide, streaming NDJSON results per step"""
+    if ocr_service is None or pii_service is None:
+        raise HTTPException(status_code=500, detail="OCR or PII service not initialized")
+
+    pipeline = RedactionPipeline(
+        ocr_service,
+        pii_service,
+        download_concurrency=int(os.getenv("REDACTION_BATCH_DOWNLOADS", "8")),
+        ocr_concurrency=int(os.getenv("REDACTION_BATCH_OCR_WORKERS", "2")),
+        image_budget=image_budget,
+    )
+    items = [step.model_dump() for step in request.steps]
+    mode = request.piiMode or os.getenv("PII_MODE", "full")
+    print(f"[BatchRedaction] Guide {request.guideId}: {len(items)} steps, PII mode {mode}")
+
+    async def stream():
+        async for result in pipeline.run(items, mode, request.piiEntities):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.post("/redaction/apply")
-async def apply_redaction(request: RedactionApplyRequest):
-    """Apply blur to detected regions"""
+async def apply_redaction(http_request: Request):
+    """Apply blur to detected regions
+
+    Returns the encoded image and thumbnails as base64 JSON for the caller
+    to store. When the image is uploaded in the body, the redacted image is
+    returned directly unless responseFormat is "json".
+    """
+    fields, image_source = await read_image_request(http_request, max_bytes=image_budget.max_bytes)
     try:
-        
+        request = RedactionApplyRequest(**fields)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+    # Raw image responses have nowhere to put thumbnails
+    raw_response = not request.screenshotUri and request.responseFormat != "json"
+    if raw_response and request.thumbnailWidths:
+        raise HTTPException(status_code=400, detail="thumbnailWidths requires responseFormat=json")
+
+    try:
+        encoding = ImageEncoding(
+            format=request.outputFormat or os.getenv("REDACTION_OUTPUT_FORMAT", "png"),
+            quality=(
+                request.quality
+                if request.quality is not None
+                else int(os.getenv("REDACTION_OUTPUT_QUALITY", "80"))
+            ),
+            thumbnail_widths=(
+                []
+                if raw_response
+                else request.thumbnailWidths
+                if request.thumbnailWidths is not None
+                else [int(w) for w in os.getenv("REDACTION_THUMBNAIL_WIDTHS", "").split(",") if w.strip()]
+            ),
+            thumbnail_format=os.getenv("REDACTION_THUMBNAIL_FORMAT", "webp"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Download image
-        async with httpx.AsyncClient() as client:
-            response = await client.get(request.screenshotUri)
-            image_bytes = response.content
+    try:
+        # Apply blur (full resolution: no draft decoding)
+        async with image_budget.admit(image_source, allow_draft=False) as image_source:
+            redacted = await within_deadline(
+                apply_blur(image_source, request.blurredRegions, encoding), "redaction"
+            )
 
-        # Apply blur
-        redacted_image = await apply_blur(image_bytes, request.blurredRegions)
+        output = redacted.image
+        print(
+            f"[Redaction] Encoded {output.format} {output.width}x{output.height}: "
+            f"{len(output.data)} bytes in {output.encode_ms}ms, {len(redacted.thumbnails)} thumbnails"
+        )
 
-        # Upload to S3 (implement upload logic)
-        redacted_uri = request.screenshotUri.replace(".png", "_redacted.png")
+        # This service has no object storage: callers (the backend media
+        # layer) upload the bytes. Uploaded images may ask for raw bytes.
+        if raw_response:
+            return Response(
+                content=output.data,
+                media_type=output.media_type,
+                headers={
+                    "X-Encode-Ms": str(output.encode_ms),
+                    "X-Output-Bytes": str(len(output.data)),
+                },
+            )
 
-        return {"redactedUri": redacted_uri}
+        return {
+            "image": base64.b64encode(output.data).decode("ascii"),
+            "encoding": output.describe(),
+            "thumbnails": [
+                {**thumb.describe(), "image": base64.b64encode(thumb.data).decode("ascii")}
+                for thumb in redacted.thumbnails
+            ],
+        }
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def compose_guide(request: DocumentRequest) -> dict:
+    """Compose a document, compacting the recorded steps first
+
+    The compaction mapping relates the step numbers in the document back to
+    the original step indices.
+    """
+    compact = request.compact
+    if compact is None:
+        compact = os.getenv("COMPOSE_COMPACTION", "true").lower() == "true"
+    if not compact:
+        document = await composer.compose(request.steps, request.style)
+        return {"document": document}
+
+    compaction = compact_steps(request.steps)
+    tokens_before = composer.estimate_prompt_tokens(request.steps, request.style)
+    tokens_after = composer.estimate_prompt_tokens(compaction.steps, request.style)
+    print(
+        f"[Composer] Guide {request.guideId}: {compaction.original_count} steps -> "
+        f"{len(compaction.steps)}, ~{tokens_before} -> ~{tokens_after} prompt tokens"
+    )
+    document = await composer.compose(compaction.steps, request.style)
+    return {"document": document, "compaction": compaction.describe(tokens_before, tokens_after)}
+
+
 @app.post("/documents/compose")
 async def compose_document(request: DocumentRequest):
     """Generate AI-composed document from steps"""
     try:
         if composer is None:
             raise HTTPException(status_code=500, detail="Document composer not initialized. Check GOOGLE_GEMINI_API_KEY.")
-        document = await composer.compose(request.steps, request.style)
-        return {"document": document}
+        return await compose_guide(request)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -257,94 +559,141 @@ async def generate_embeddings(steps: List[dict]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/steps/enhance")
-async def enhance_step(request: StepEnhanceRequest):
-    """Enhance step description using AI"""
-    print("\n" + "="*80)
-    print("🤖 GEMINI AI STEP ENHANCEMENT STARTED")
-    print("="*80)
-    print(f"📝 Current Description: {request.currentDescription}")
-    print(f"📊 Context: {request.context}")
-    
+# Pooled guide vectors, updated per step without re-embedding the guide
+guide_embeddings = GuideEmbeddingStore(os.getenv("EMBEDDINGS_DB_PATH", "embeddings.db"))
+
+
+async def embed_guide_step(step: GuideStepEmbeddingRequest) -> List[float]:
+    if step.embedding:
+        return step.embedding
+    if embedding_service is None:
+        raise HTTPException(status_code=500, detail="Embedding service not initialized. Check GOOGLE_GEMINI_API_KEY.")
+    return await embedding_service.generate_step_embedding(step.model_dump())
+
+
+@app.post("/embeddings/guides/{guide_id}")
+async def build_guide_embedding(guide_id: str, request: GuideEmbeddingRequest):
+    """(Re)build a guide vector from all of its steps"""
     try:
-        if composer is None:
-            print("❌ ERROR: Composer not initialized")
-            raise HTTPException(status_code=500, detail="AI service not initialized. Check GOOGLE_GEMINI_API_KEY.")
-        
-        print("✅ Composer initialized, proceeding with enhancement...")
-        
-        
-        
-        # Build prompt for step enhancement
-        event_type = request.context.get('eventType', 'unknown')
-        target = request.context.get('target', {})
-        url = request.context.get('url', '')
-        selector = request.context.get('selector', '')
-        text_content = target.get('textContent', '') if isinstance(target, dict) else ''
-        
-        # Build a more intelligent prompt
-        target_info = []
-        if target.get('tagName'):
-            target_info.append(target.get('tagName').lower())
-        if target.get('id'):
-            target_info.append(f"with ID '{target.get('id')}'")
-        if target.get('className'):
-            classes = [c for c in target.get('className', '').split(' ') if c]
-            if classes:
-                target_info.append(f"with class '{classes[0]}'")
-        if text_content:
-            # Use text content to identify buttons/links better
-            target_info.append(f"labeled '{text_content[:50]}'")
-        
-        target_description = ' '.join(target_info) if target_info else 'the element'
-        
-        # Determine action context
-        action_context = ""
-        if event_type == 'click':
-            if 'button' in target_description or 'btn' in (target.get('className', '') or '').lower():
-                action_context = "button"
-            elif 'link' in target_description or target.get('tagName', '').lower() == 'a':
-                action_context = "link"
-            elif 'input' in target_description or target.get('tagName', '').lower() == 'input':
-                action_context = "input field"
-            else:
-                action_context = "element"
-        elif event_type == 'navigation':
-            # Extract domain or page name from URL
-            try:
-                
-                parsed = urlparse(url)
-                domain = parsed.netloc.replace('www.', '')
-                path = parsed.path.strip('/').replace('/', ' > ')
-                action_context = f"to {domain}" + (f" ({path})" if path else "")
-            except:
-                action_context = "to the page"
-        
-        # Extract page context from URL
-        page_context = ""
+        vectors = await asyncio.gather(*[embed_guide_step(step) for step in request.steps])
+        pool = GuideEmbedding()
+        for step, vector in zip(request.steps, vectors):
+            pool.upsert(step.id, vector, step_weight(step.model_dump()))
+        described = await asyncio.to_thread(guide_embeddings.replace, guide_id, pool)
+        return {"guideId": guide_id, **described}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/embeddings/guides/{guide_id}")
+async def get_guide_embedding(guide_id: str):
+    described = await asyncio.to_thread(guide_embeddings.get, guide_id)
+    if described is None:
+        raise HTTPException(status_code=404, detail=f"No embedding for guide {guide_id}")
+    return {"guideId": guide_id, **described}
+
+
+@app.put("/embeddings/guides/{guide_id}/steps/{step_id}")
+async def upsert_guide_step_embedding(guide_id: str, step_id: str, request: GuideStepEmbeddingRequest):
+    """Add or edit one step; only that step is embedded (or cached)"""
+    try:
+        vector = await embed_guide_step(request)
+        described = await asyncio.to_thread(
+            guide_embeddings.upsert, guide_id, step_id, vector, step_weight(request.model_dump())
+        )
+        return {"guideId": guide_id, "stepEmbedding": vector, **described}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/embeddings/guides/{guide_id}/steps/{step_id}")
+async def remove_guide_step_embedding(guide_id: str, step_id: str):
+    described = await asyncio.to_thread(guide_embeddings.remove, guide_id, step_id)
+    if described is None:
+        raise HTTPException(status_code=404, detail=f"Step {step_id} not in guide {guide_id} embedding")
+    return {"guideId": guide_id, **described}
+
+
+async def enhance_description(current_description: str, context: dict) -> str:
+    """Rewrite a basic step description with Gemini, using the DOM context"""
+    # Build prompt for step enhancement
+    event_type = context.get('eventType', 'unknown')
+    target = context.get('target', {})
+    url = context.get('url', '')
+    selector = context.get('selector', '')
+    text_content = target.get('textContent', '') if isinstance(target, dict) else ''
+    
+    # Build a more intelligent prompt
+    target_info = []
+    if target.get('tagName'):
+        target_info.append(target.get('tagName').lower())
+    if target.get('id'):
+        target_info.append(f"with ID '{target.get('id')}'")
+    if target.get('className'):
+        classes = [c for c in target.get('className', '').split(' ') if c]
+        if classes:
+            target_info.append(f"with class '{classes[0]}'")
+    if text_content:
+        # Use text content to identify buttons/links better
+        target_info.append(f"labeled '{text_content[:50]}'")
+    
+    target_description = ' '.join(target_info) if target_info else 'the element'
+    
+    # Determine action context
+    action_context = ""
+    if event_type == 'click':
+        if 'button' in target_description or 'btn' in (target.get('className', '') or '').lower():
+            action_context = "button"
+        elif 'link' in target_description or target.get('tagName', '').lower() == 'a':
+            action_context = "link"
+        elif 'input' in target_description or target.get('tagName', '').lower() == 'input':
+            action_context = "input field"
+        else:
+            action_context = "element"
+    elif event_type == 'navigation':
+        # Extract domain or page name from URL
         try:
+            
             parsed = urlparse(url)
             domain = parsed.netloc.replace('www.', '')
-            path_parts = [p for p in parsed.path.strip('/').split('/') if p]
-            if path_parts:
-                page_context = f" on {domain} ({'/'.join(path_parts[:2])})"
-            else:
-                page_context = f" on {domain}"
+            path = parsed.path.strip('/').replace('/', ' > ')
+            action_context = f"to {domain}" + (f" ({path})" if path else "")
         except:
-            page_context = ""
-        
-        button_text = text_content.strip() if text_content else ""
-        
-        prompt = f"""You are an expert technical writer creating clear, professional step-by-step instructions for user guides.
+            action_context = "to the page"
+    
+    # Extract page context from URL
+    page_context = ""
+    try:
+        parsed = urlparse(url)
+        domain = parsed.netloc.replace('www.', '')
+        path_parts = [p for p in parsed.path.strip('/').split('/') if p]
+        if path_parts:
+            page_context = f" on {domain} ({'/'.join(path_parts[:2])})"
+        else:
+            page_context = f" on {domain}"
+    except:
+        page_context = ""
+    
+    button_text = text_content.strip() if text_content else ""
+    
+    prompt = f"""You are an expert technical writer creating clear, professional step-by-step instructions for user guides.
 
-Current basic description: "{request.currentDescription}"
+Current basic description: "{current_description}"
 
 Context:
 - Action: {event_type}
 - Target element: {target_description}
 - Button/Link text: "{button_text}" (if available)
 - Page: {url}{page_context}
-- Step number: {request.context.get('stepIndex', 0) + 1}
+- Step number: {context.get('stepIndex', 0) + 1}
 
 Rewrite this step description to be:
 1. Professional and clear (use imperative mood: "Click", "Navigate", "Enter", "Select")
@@ -363,43 +712,70 @@ Examples of good descriptions:
 - "Enter text in the search field"
 
 Return ONLY the enhanced description text, nothing else. Keep it to 1-2 sentences maximum. Make it sound professional and intelligent."""
-        
-        print("\n" + "-"*80)
-        print("📤 SENDING PROMPT TO GEMINI AI MODEL")
-        print("-"*80)
-        print(f"Prompt length: {len(prompt)} characters")
-        print(f"Model: gemini-2.5-flash")
-        print(f"Temperature: 0.7")
-        print(f"Max tokens: 500")
-        print("-"*80)
-        
-        response = composer.model.generate_content(
+    
+    print("\n" + "-"*80)
+    print("📤 SENDING PROMPT TO GEMINI AI MODEL")
+    print("-"*80)
+    print(f"Prompt length: {len(prompt)} characters")
+    print(f"Model: gemini-2.5-flash")
+    print(f"Temperature: 0.7")
+    print(f"Max tokens: 500")
+    print("-"*80)
+    
+    # Async Gemini call, bounded by the request deadline and hedged past p95
+    # so concurrent stages (see /steps/analyze) are not serialized behind it
+    response = await enhance_hedger.call(
+        lambda: composer.model.generate_content_async(
             prompt,
             generation_config=genai.types.GenerationConfig(
                 temperature=0.7,
                 max_output_tokens=500,
-            )
+            ),
         )
+    )
+
+    print("\n" + "-"*80)
+    print("📥 GEMINI AI RESPONSE RECEIVED")
+    print("-"*80)
+    print(f"Response type: {type(response)}")
+
+    # Use robust extractor
+    enhanced_description = extract_gemini_text(response)
+    if not enhanced_description:
+        print("❌ No text extracted from Gemini response, falling back to original description")
+        enhanced_description = current_description
+    else:
+        print("✅ Successfully extracted enhanced description")
+        print(f"📝 Raw response: {enhanced_description}")
 
-        print("\n" + "-"*80)
-        print("📥 GEMINI AI RESPONSE RECEIVED")
-        print("-"*80)
-        print(f"Response type: {type(response)}")
+    
+    # Clean up the response (remove quotes if present)
+    if enhanced_description.startswith('"') and enhanced_description.endswith('"'):
+        enhanced_description = enhanced_description[1:-1]
+        print("🧹 Cleaned quotes from response")
 
-        # Use robust extractor
-        enhanced_description = extract_gemini_text(response)
-        if not enhanced_description:
-            print("❌ No text extracted from Gemini response, falling back to original description")
-            enhanced_description = request.currentDescription
-        else:
-            print("✅ Successfully extracted enhanced description")
-            print(f"📝 Raw response: {enhanced_description}")
+    return enhanced_description
 
+
+@app.post("/api/steps/enhance")
+async def enhance_step(request: StepEnhanceRequest):
+    """Enhance step description using AI"""
+    print("\n" + "="*80)
+    print("🤖 GEMINI AI STEP ENHANCEMENT STARTED")
+    print("="*80)
+    print(f"📝 Current Description: {request.currentDescription}")
+    print(f"📊 Context: {request.context}")
+    
+    try:
+        if composer is None:
+            print("❌ ERROR: Composer not initialized")
+            raise HTTPException(status_code=500, detail="AI service not initialized. Check GOOGLE_GEMINI_API_KEY.")
+        
+        print("✅ Composer initialized, proceeding with enhancement...")
+        
+        
         
-        # Clean up the response (remove quotes if present)
-        if enhanced_description.startswith('"') and enhanced_description.endswith('"'):
-            enhanced_description = enhanced_description[1:-1]
-            print("🧹 Cleaned quotes from response")
+        enhanced_description = await enhance_description(request.currentDescription, request.context)
         
         print("\n" + "="*80)
         print("✅ GEMINI AI ENHANCEMENT COMPLETED")
@@ -408,6 +784,9 @@ Return ONLY the enhanced description text, nothing else. Keep it to 1-2 sentence
         print("="*80 + "\n")
         
         return {"enhancedDescription": enhanced_description}
+    except DeadlineExceeded as e:
+        print(f"⏱️ Gemini AI enhancement gave up: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print("\n" + "="*80)
         print("❌ GEMINI AI ENHANCEMENT FAILED")
@@ -418,6 +797,157 @@ Return ONLY the enhanced description text, nothing else. Keep it to 1-2 sentence
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/steps/analyze")
+async def analyze_step(http_request: Request):
+    """Run OCR, PII, description enhancement and embedding for one step
+
+    The screenshot (JSON screenshotUri, multipart upload or raw body) is
+    decoded once and shared by all stages. Returns one combined result with
+    per-stage timings and per-stage errors.
+    """
+    fields, image_source = await read_image_request(
+        http_request, require_image=False, max_bytes=image_budget.max_bytes
+    )
+    try:
+        request = StepAnalyzeRequest(**fields)
+        stages = StepAnalyzer.resolve_stages(request.stages, has_image=image_source is not None)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        analyzer = StepAnalyzer(
+            ocr_service,
+            pii_service,
+            embedding_service,
+            enhance_description if composer is not None else None,
+        )
+        async with image_budget.admit(image_source) as image_source:
+            result = await analyzer.analyze(
+                stages,
+                image_source=image_source,
+                description=request.currentDescription,
+                context=request.context,
+                dom_event=request.domEvent,
+                pii_mode=request.piiMode or os.getenv("PII_MODE", "full"),
+                pii_entities=request.piiEntities,
+            )
+        result["stepId"] = request.stepId
+        print(f"[StepAnalysis] Step {request.stepId} stages {stages}: {result['timings']}")
+        return result
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def run_compose_job(payload: dict):
+    if composer is None:
+        raise RuntimeError("Document composer not initialized. Check GOOGLE_GEMINI_API_KEY.")
+    return await compose_guide(DocumentRequest(**payload))
+
+
+async def run_redaction_job(payload: dict):
+    if ocr_service is None or pii_service is None:
+        raise RuntimeError("OCR or PII service not initialized")
+    request = BatchRedactionRequest(**payload)
+    pipeline = RedactionPipeline(
+        ocr_service,
+        pii_service,
+        download_concurrency=int(os.getenv("REDACTION_BATCH_DOWNLOADS", "8")),
+        ocr_concurrency=int(os.getenv("REDACTION_BATCH_OCR_WORKERS", "2")),
+        image_budget=image_budget,
+    )
+    items = [step.model_dump() for step in request.steps]
+    mode = request.piiMode or os.getenv("PII_MODE", "full")
+    return {"results": [result async for result in pipeline.run(items, mode, request.piiEntities)]}
+
+
+async def run_embedding_job(payload: dict):
+    if embedding_service is None:
+        raise RuntimeError("Embedding service not initialized. Check GOOGLE_GEMINI_API_KEY.")
+    steps = EmbeddingJobRequest(**payload).steps
+    embeddings = await asyncio.gather(*[embedding_service.generate_step_embedding(step) for step in steps])
+    return {"embeddings": list(embeddings)}
+
+
+# Long-running AI work is queued in a local SQLite database and run by a
+# small worker pool, so clients don't hold a connection open for minutes
+job_queue = JobQueue(
+    JobStore(os.getenv("JOBS_DB_PATH", "jobs.db")),
+    handlers={
+        "compose": run_compose_job,
+        "redaction": run_redaction_job,
+        "embedding": run_embedding_job,
+    },
+    concurrency=int(os.getenv("JOBS_CONCURRENCY", "2")),
+    result_ttl=float(os.getenv("JOBS_RESULT_TTL", "86400")),
+    max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+)
+
+# Payloads are validated at submit time so bad input is a 422, not a failed job
+JOB_PAYLOADS = {
+    "compose": DocumentRequest,
+    "redaction": BatchRedactionRequest,
+    "embedding": EmbeddingJobRequest,
+}
+
+MAX_JOB_WAIT = 60.0
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest, http_request: Request):
+    """Queue a compose, redaction or embedding job and return its id
+
+    An idempotencyKey (or Idempotency-Key header) makes retries safe: the
+    same key returns the original job while its result is retained, and
+    reusing it for a different kind or payload is a 409.
+    """
+    idempotency_key = request.idempotencyKey or http_request.headers.get("Idempotency-Key")
+    payload_model = JOB_PAYLOADS.get(request.kind)
+    if payload_model is not None:
+        try:
+            payload_model(**request.payload)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors())
+    try:
+        return await job_queue.submit(request.kind, request.payload, idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Job counts by status"""
+    return await asyncio.to_thread(job_queue.store.counts)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status and result; `wait` long-polls up to that many seconds"""
+    job = await job_queue.get(job_id, wait=max(0.0, min(wait, MAX_JOB_WAIT)))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
 if __name__ == "__main__":
     
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -55,6 +55,7 @@ export class StepProcessor {
 
       // Try to find corresponding screenshot if available
       let screenshotUri = null;
+      let screenshotBuffer: Buffer | null = null;
       if (workflow.screenshots && workflow.screenshots.length > 0) {
         const matchingScreenshot = workflow.screenshots.find(
           (s: any) => s.stepIndex === stepIndex || s.domEvent?.timestamp === event.timestamp
@@ -71,6 +72,7 @@ export class StepProcessor {
             const uploadedKey = await this.mediaService.processScreenshot(key, buffer);
             // Get the public URL for the screenshot
             screenshotUri = await this.mediaService.getMediaUrl(uploadedKey);
+            screenshotBuffer = buffer;
             console.log('[StepProcessor] Uploaded screenshot:', screenshotUri);
           } catch (error) {
             console.error('[StepProcessor] Failed to upload screenshot:', error);
@@ -97,7 +99,7 @@ export class StepProcessor {
       // Enhance description using AI (async, don't block)
       // Wait a bit to ensure step is saved first
       setTimeout(() => {
-        this.enhanceStepDescription(step, event, screenshotUri).catch(error => {
+        this.enhanceStepDescription(step, event, screenshotUri, screenshotBuffer).catch(error => {
           console.error('[StepProcessor] Failed to enhance step description:', error);
         });
       }, 500);
@@ -130,9 +132,17 @@ export class StepProcessor {
   }
 
   /**
-   * Enhance step description using AI
+   * Enhance step description using AI.
+   * Uses the AI service's /steps/analyze endpoint so that all per-step work
+   * (STEP_ANALYZE_STAGES, default "enhance") happens in one call. The
+   * screenshot we already hold is uploaded directly when image stages run.
    */
-  private async enhanceStepDescription(step: Step, event: any, screenshotUri: string | null): Promise<void> {
+  private async enhanceStepDescription(
+    step: Step,
+    event: any,
+    screenshotUri: string | null,
+    screenshotBuffer: Buffer | null = null,
+  ): Promise<void> {
     try {
       // Build context for AI with more details
       const target = event.target || {};
@@ -156,20 +166,47 @@ export class StepProcessor {
       console.log('[StepProcessor] 📝 Current description:', step.description);
       console.log('[StepProcessor] 📊 Context:', JSON.stringify(context, null, 2));
 
-      // Call AI service to enhance description
+      const imageStages = ['ocr', 'pii'];
+      let stages = (process.env.STEP_ANALYZE_STAGES || 'enhance')
+        .split(',')
+        .map((stage) => stage.trim())
+        .filter((stage) => stage && (screenshotBuffer || !imageStages.includes(stage)));
+      if (stages.length === 0) {
+        stages = ['enhance'];
+      }
+
+      const form = new FormData();
+      form.append('stepId', step.id);
+      form.append('currentDescription', step.description);
+      form.append('context', JSON.stringify(context));
+      form.append('domEvent', JSON.stringify(event));
+      form.append('stages', JSON.stringify(stages));
+      if (screenshotBuffer && stages.some((stage) => imageStages.includes(stage))) {
+        form.append('screenshot', new Blob([screenshotBuffer], { type: 'image/png' }), 'screenshot.png');
+      }
+
+      // Call AI service to analyze the step. The deadline header leaves
+      // headroom under the HTTP timeout so the AI service gives up first
+      const timeoutMs = 10000;
       const response = await firstValueFrom(
-        this.httpService.post(
-          `${this.aiServiceUrl}/api/steps/enhance`,
-          {
-            currentDescription: step.description,
-            context,
-          },
-          {
-            timeout: 10000, // 10 second timeout
-          }
-        )
+        this.httpService.post(`${this.aiServiceUrl}/steps/analyze`, form, {
+          timeout: timeoutMs, // 10 second timeout
+          headers: { 'X-Request-Timeout-Ms': String(timeoutMs - 500) },
+        })
       );
 
+      if (response.data?.timings) {
+        console.log('[StepProcessor] ⏱️ Analysis timings:', response.data.timings);
+      }
+
+      if (response.data?.pii) {
+        step.redactionMetadata = {
+          blurredRegions: response.data.pii.blurredRegions,
+          detectedPII: response.data.pii.entities,
+        };
+        await this.stepRepository.save(step);
+      }
+
       if (response.data && response.data.enhancedDescription) {
         // Update step with enhanced description
         console.log('[StepProcessor] ✅ Gemini AI response received');
@@ -44,6 +44,14 @@ export class MediaService {
     return finalKey;
   }
 
+  /**
+   * Store an already encoded image as-is and return its URL
+   */
+  async storeImage(key: string, body: Buffer, contentType: string): Promise<string> {
+    await this.s3Service.upload(key, body, contentType);
+    return this.getMediaUrl(key);
+  }
+
   /**
    * Get public URL for media
    */
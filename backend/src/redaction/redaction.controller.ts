@@ -1,26 +1,65 @@
-import { Controller, Post, Body, UseGuards, Request } from '@nestjs/common';
+import { Controller, Post, Body, UseGuards, Request, Res } from '@nestjs/common';
+import { Response } from 'express';
 import { RedactionService } from './redaction.service';
+import { GuidesService } from '../guides/guides.service';
 import { JwtAuthGuard } from '../auth/jwt-auth.guard';
 
 @Controller('redaction')
 @UseGuards(JwtAuthGuard)
 export class RedactionController {
-  constructor(private readonly redactionService: RedactionService) {}
+  constructor(
+    private readonly redactionService: RedactionService,
+    private readonly guidesService: GuidesService,
+  ) {}
 
   @Post('process')
   async processRedaction(@Body() body: { stepId: string; screenshotUri: string }) {
     return this.redactionService.processRedaction(body.stepId, body.screenshotUri);
   }
 
+  @Post('process/batch')
+  async processGuideRedaction(
+    @Body() body: { guideId: string },
+    @Request() req: any,
+    @Res() res: Response,
+  ) {
+    const organizationId = req.user?.organizationId || 'default-org';
+    const guide = await this.guidesService.findOne(body.guideId, organizationId);
+    const steps = (guide.steps || [])
+      .filter((step) => !!step.screenshotUri)
+      .map((step) => ({ stepId: step.id, screenshotUri: step.screenshotUri }));
+
+    // Forward each step's result as an NDJSON line as soon as it is ready;
+    // stop the AI service's pipeline if the client goes away
+    const abort = new AbortController();
+    res.on('close', () => abort.abort());
+    res.setHeader('Content-Type', 'application/x-ndjson');
+    res.setHeader('X-Guide-Id', guide.id);
+    res.flushHeaders();
+
+    try {
+      await this.redactionService.processGuideRedaction(
+        guide.id,
+        steps,
+        (result) => res.write(JSON.stringify(result) + '\n'),
+        abort.signal,
+      );
+    } catch (error) {
+      if (!res.destroyed) {
+        res.write(JSON.stringify({ guideId: guide.id, error: error.message || 'Redaction failed' }) + '\n');
+      }
+    }
+    res.end();
+  }
+
   @Post('apply')
   async applyRedaction(
     @Body() body: { screenshotUri: string; blurredRegions: any[] },
   ) {
-    const redactedUri = await this.redactionService.applyRedaction(
+    return this.redactionService.applyRedaction(
       body.screenshotUri,
       body.blurredRegions,
     );
-    return { redactedUri };
   }
 }
 
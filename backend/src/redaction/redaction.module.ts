@@ -3,9 +3,10 @@ import { RedactionController } from './redaction.controller';
 import { RedactionService } from './redaction.service';
 import { GuidesModule } from '../guides/guides.module';
 import { HttpModule } from '@nestjs/axios';
+import { MediaModule } from '../media/media.module';
 
 @Module({
-  imports: [GuidesModule, HttpModule],
+  imports: [GuidesModule, HttpModule, MediaModule],
   controllers: [RedactionController],
   providers: [RedactionService],
 })
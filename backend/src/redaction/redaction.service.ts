@@ -1,10 +1,15 @@
 import { Injectable } from '@nestjs/common';
 import { HttpService } from '@nestjs/axios';
 import { firstValueFrom } from 'rxjs';
+import { v4 as uuidv4 } from 'uuid';
+import { MediaService } from '../media/media.service';
 
 @Injectable()
 export class RedactionService {
-  constructor(private readonly httpService: HttpService) {}
+  constructor(
+    private readonly httpService: HttpService,
+    private readonly mediaService: MediaService,
+  ) {}
 
   /**
    * Process redaction for a step
@@ -29,9 +34,85 @@ export class RedactionService {
   }
 
   /**
-   * Apply redaction blur to screenshot
+   * Process redaction for every step of a guide in one pipelined call.
+   * The AI service streams NDJSON results as each step completes; each one
+   * is handed to onResult as it arrives. The stream is aborted if no result
+   * arrives within the idle timeout or when the signal fires.
    */
-  async applyRedaction(screenshotUri: string, blurredRegions: any[]): Promise<string> {
+  async processGuideRedaction(
+    guideId: string,
+    steps: { stepId: string; screenshotUri: string }[],
+    onResult?: (result: any) => void,
+    signal?: AbortSignal,
+  ): Promise<any[]> {
+    const aiServiceUrl = process.env.AI_SERVICE_URL || 'http://ai-service:8000';
+    // Longest wait for the next step's result (one step's download, OCR and PII)
+    const idleTimeoutMs = 60000;
+
+    try {
+      const response = await firstValueFrom(
+        this.httpService.post(
+          `${aiServiceUrl}/redaction/process/batch`,
+          { guideId, steps },
+          { responseType: 'stream', timeout: idleTimeoutMs, signal },
+        ),
+      );
+
+      const results: any[] = [];
+      let buffered = '';
+      const handleLine = (line: string) => {
+        if (!line.trim()) return;
+        const result = JSON.parse(line);
+        results.push(result);
+        onResult?.(result);
+      };
+
+      await new Promise<void>((resolve, reject) => {
+        let idleTimer: NodeJS.Timeout;
+        const resetIdleTimer = () => {
+          clearTimeout(idleTimer);
+          idleTimer = setTimeout(() => {
+            response.data.destroy(
+              new Error(`No redaction result for ${idleTimeoutMs}ms`),
+            );
+          }, idleTimeoutMs);
+        };
+        resetIdleTimer();
+
+        response.data.on('data', (chunk: Buffer) => {
+          resetIdleTimer();
+          buffered += chunk.toString('utf8');
+          const lines = buffered.split('\n');
+          buffered = lines.pop() || '';
+          lines.forEach(handleLine);
+        });
+        response.data.on('end', () => {
+          clearTimeout(idleTimer);
+          handleLine(buffered);
+          resolve();
+        });
+        response.data.on('error', (error: Error) => {
+          clearTimeout(idleTimer);
+          reject(error);
+        });
+      });
+
+      return results;
+    } catch (error) {
+      console.error('[Redaction] Failed to process guide:', error);
+      throw error;
+    }
+  }
+
+  /**
+   * Apply redaction blur to screenshot.
+   * The AI service returns the encoded image and thumbnails; they are stored
+   * through the media layer and their URLs returned.
+   */
+  async applyRedaction(
+    screenshotUri: string,
+    blurredRegions: any[],
+  ): Promise<{ redactedUri: string; thumbnails: { width: number; uri: string }[] }> {
     const aiServiceUrl = process.env.AI_SERVICE_URL || 'http://ai-service:8000';
 
     try {
@@ -39,10 +120,31 @@ export class RedactionService {
         this.httpService.post(`${aiServiceUrl}/redaction/apply`, {
           screenshotUri,
           blurredRegions,
+          responseFormat: 'json',
         }),
       );
 
-      return response.data.redactedUri;
+      const { image, encoding, thumbnails = [] } = response.data;
+      const baseKey = `redacted/${Date.now()}-${uuidv4().split('-')[0]}`;
+      const extension = (mediaType: string) => mediaType.split('/')[1] || 'png';
+
+      const redactedUri = await this.mediaService.storeImage(
+        `${baseKey}.${extension(encoding.mediaType)}`,
+        Buffer.from(image, 'base64'),
+        encoding.mediaType,
+      );
+      const storedThumbnails = await Promise.all(
+        thumbnails.map(async (thumb: any) => ({
+          width: thumb.width,
+          uri: await this.mediaService.storeImage(
+            `${baseKey}-${thumb.width}w.${extension(thumb.mediaType)}`,
+            Buffer.from(thumb.image, 'base64'),
+            thumb.mediaType,
+          ),
+        })),
+      );
+
+      return { redactedUri, thumbnails: storedThumbnails };
     } catch (error) {
       console.error('[Redaction] Failed to apply redaction:', error);
       throw error;
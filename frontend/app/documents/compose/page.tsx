@@ -32,20 +32,45 @@ export default function DocumentComposerPage() {
       )
       const guide = await guideResponse.json()
 
-      // Compose document
-      const response = await fetch('http://localhost:8000/documents/compose', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          guideId,
-          steps: guide.steps,
-          style,
-        }),
-      })
-      const data = await response.json()
-      setDocumentText(data.document)
+      // Queue composition as a job, then long-poll until it finishes.
+      // One key per click: a retried submit returns the same job.
+      const idempotencyKey = crypto.randomUUID()
+      const submitJob = () =>
+        fetch('http://localhost:8000/jobs', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey,
+          },
+          body: JSON.stringify({
+            kind: 'compose',
+            payload: {
+              guideId,
+              steps: guide.steps,
+              style,
+            },
+          }),
+        })
+      let submitResponse: Response | null = null
+      for (let attempt = 0; attempt < 3 && !submitResponse; attempt++) {
+        try {
+          submitResponse = await submitJob()
+        } catch (error) {
+          if (attempt === 2) throw error
+        }
+      }
+      if (!submitResponse!.ok) {
+        throw new Error(`Failed to queue composition (${submitResponse!.status})`)
+      }
+      let job = await submitResponse!.json()
+      while (job.status === 'queued' || job.status === 'running') {
+        const pollResponse = await fetch(`http://localhost:8000/jobs/${job.id}?wait=30`)
+        job = await pollResponse.json()
+      }
+      if (job.status !== 'succeeded') {
+        throw new Error(job.error || 'Document composition failed')
+      }
+      setDocumentText(job.result.document)
     } catch (error) {
       console.error('Failed to compose document:', error)
       alert('Failed to compose document')